@@ -0,0 +1,241 @@
+from functools import wraps
+
+from asgiref.sync import sync_to_async
+from django.contrib.auth.models import AnonymousUser
+from django.core.exceptions import ValidationError
+from django.db import IntegrityError, transaction
+from django.db.models import prefetch_related_objects
+from django.http import HttpResponse
+from django.utils.translation import gettext_lazy as _
+from rest_framework import exceptions, status
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+
+from recipes import counters
+from recipes.models import Favorite, Recipe, ShoppingCart
+from users.models import CustomUser, Follower
+
+from .budgets import query_budget
+from .queries import annotate_user_flags, recipe_prefetches
+from .serializers import (FollowingUserSerializer, RecipeSerializer,
+                          ShortRecipeSerializer)
+from .utils import counter_field, update_shopping_list
+from .views import RecipeViewSet
+
+renderer = JSONRenderer()
+
+recipe_detail_view = RecipeViewSet.as_view({
+    'get': 'retrieve',
+    'put': 'update',
+    'patch': 'partial_update',
+    'delete': 'destroy',
+})
+
+
+def json_response(data=None, status=status.HTTP_200_OK):
+    """Ответ в том же виде, что отдаёт Response DRF с JSONRenderer."""
+    if data is None:
+        response = HttpResponse(status=status)
+        del response['Content-Type']
+        return response
+    return HttpResponse(
+        renderer.render(data), content_type='application/json',
+        status=status,
+    )
+
+
+async def authenticate(request):
+    """Асинхронный аналог TokenAuthentication."""
+    auth = request.headers.get('Authorization', '').split()
+    if not auth or auth[0].lower() != 'token':
+        return None
+    if len(auth) == 1:
+        raise exceptions.AuthenticationFailed(
+            _('Invalid token header. No credentials provided.')
+        )
+    if len(auth) > 2:
+        raise exceptions.AuthenticationFailed(
+            _('Invalid token header. Token string should not contain spaces.')
+        )
+    try:
+        token = await Token.objects.select_related('user').aget(key=auth[1])
+    except Token.DoesNotExist:
+        raise exceptions.AuthenticationFailed(_('Invalid token.'))
+    if not token.user.is_active:
+        raise exceptions.AuthenticationFailed(_('User inactive or deleted.'))
+    return token.user
+
+
+def async_api_view(methods, authenticated=True):
+    """
+    Асинхронный аналог @api_view с аутентификацией по токену: проверяет
+    токен, права и метод в том же порядке, что и DRF, и отдаёт ошибки
+    в формате DRF.
+    """
+    def decorator(view):
+        @wraps(view)
+        async def wrapper(request, *args, **kwargs):
+            try:
+                request.user = await authenticate(request) or AnonymousUser()
+                if authenticated and not request.user.is_authenticated:
+                    raise exceptions.NotAuthenticated
+                if request.method not in methods:
+                    raise exceptions.MethodNotAllowed(request.method)
+                return await view(request, *args, **kwargs)
+            except exceptions.APIException as exception:
+                response = json_response(
+                    {'detail': exception.detail}, exception.status_code
+                )
+                if isinstance(exception, (exceptions.NotAuthenticated,
+                                          exceptions.AuthenticationFailed)):
+                    response['WWW-Authenticate'] = 'Token'
+                return response
+
+        # csrf_exempt в Django 4.2 не поддерживает асинхронные функции.
+        wrapper.csrf_exempt = True
+        wrapper.http_method_names = [method.lower() for method in methods]
+        return wrapper
+    return decorator
+
+
+async def get_or_404(queryset, **lookups):
+    try:
+        return await queryset.aget(**lookups)
+    except queryset.model.DoesNotExist:
+        raise exceptions.NotFound
+
+
+@sync_to_async
+@transaction.atomic
+def save_relation(relation, delta, model, pk, field):
+    """
+    Создаёт (delta > 0) или удаляет связь и меняет счётчик объекта
+    в одной транзакции.
+    """
+    if delta > 0:
+        relation.save(force_insert=True)
+    else:
+        relation.delete()
+    counters.change(model, pk, field, delta)
+    if isinstance(relation, ShoppingCart):
+        update_shopping_list(relation.user, relation.recipe)
+
+
+async def toggle_recipe_relation(request, id, model, add_to):
+    """
+    Асинхронный вариант post_delete_logic. Django 4.2 не поддерживает
+    транзакции в асинхронном коде, поэтому запись со счётчиком выполняется
+    одним вызовом sync_to_async.
+    """
+    recipe = await get_or_404(Recipe.objects, id=id)
+    field = counter_field(model)
+    if request.method == 'POST':
+        try:
+            await save_relation(
+                model(user=request.user, recipe=recipe), 1,
+                Recipe, recipe.id, field,
+            )
+        except IntegrityError:
+            return json_response(
+                {'error': f'Рецепт уже добавлен в {add_to}'},
+                status.HTTP_400_BAD_REQUEST
+            )
+        return json_response(
+            ShortRecipeSerializer(recipe).data, status.HTTP_201_CREATED
+        )
+
+    relation = await get_or_404(
+        model.objects, user=request.user, recipe=recipe
+    )
+    # Связанные объекты уже загружены, повторно их не запрашиваем.
+    relation.user, relation.recipe = request.user, recipe
+    await save_relation(relation, -1, Recipe, recipe.id, field)
+    return json_response(status=status.HTTP_204_NO_CONTENT)
+
+
+@query_budget({'post': 6, 'delete': 7})
+@async_api_view(['POST', 'DELETE'])
+async def add_delete_favorite(request, id):
+    return await toggle_recipe_relation(request, id, Favorite, 'избранное')
+
+
+@query_budget({'post': 13, 'delete': 14})
+@async_api_view(['POST', 'DELETE'])
+async def add_delete_shoppingcart(request, id):
+    return await toggle_recipe_relation(request, id, ShoppingCart, 'корзину')
+
+
+@query_budget({'post': 7, 'delete': 7})
+@async_api_view(['POST', 'DELETE'])
+async def subscribe(request, id):
+    following_user = await get_or_404(CustomUser.objects, id=id)
+
+    if request.method == 'POST':
+        try:
+            await save_relation(
+                Follower(
+                    followed_user=request.user, following_user=following_user
+                ),
+                1, CustomUser, following_user.id, 'followers_count',
+            )
+        except ValidationError:
+            return json_response(
+                {'error': 'Нельзя подписаться на самого себя'},
+                status.HTTP_400_BAD_REQUEST
+            )
+        except IntegrityError:
+            return json_response(
+                {'error': 'Вы уже подписаны на данного пользователя'},
+                status.HTTP_400_BAD_REQUEST
+            )
+        following_user.followers_count += 1
+        serializer = FollowingUserSerializer(
+            following_user,
+            context={'request': request, 'is_subscribed': True}
+        )
+        data = await sync_to_async(lambda: serializer.data)()
+        return json_response(data, status.HTTP_201_CREATED)
+
+    follow_relation = await get_or_404(
+        Follower.objects,
+        followed_user=request.user,
+        following_user=following_user,
+    )
+    await save_relation(
+        follow_relation, -1, CustomUser, following_user.id, 'followers_count'
+    )
+    return json_response(status=status.HTTP_204_NO_CONTENT)
+
+
+@async_api_view(['GET'])
+async def retrieve_recipe(request, pk):
+    recipe = await get_or_404(
+        annotate_user_flags(
+            Recipe.objects.select_related('author'), request.user
+        ),
+        pk=pk,
+    )
+    # Асинхронного prefetch_related в Django 4.2 нет.
+    await sync_to_async(prefetch_related_objects)(
+        [recipe], *recipe_prefetches()
+    )
+    serializer = RecipeSerializer(recipe, context={'request': request})
+    data = await sync_to_async(lambda: serializer.data)()
+    return json_response(data)
+
+
+@query_budget({'get': 4, 'put': 24, 'patch': 24, 'delete': 20})
+async def recipe_detail(request, pk):
+    """
+    Рецепт для пользователя с токеном читается асинхронно. Анонимные
+    запросы, которые обслуживает кэш ответов, изменение и удаление
+    выполняет RecipeViewSet.
+    """
+    if request.method == 'GET' and 'Authorization' in request.headers:
+        return await retrieve_recipe(request, pk)
+    # Маршрутизатор DRF передаёт pk строкой.
+    return await sync_to_async(recipe_detail_view)(request, pk=str(pk))
+
+
+recipe_detail.csrf_exempt = True
+recipe_detail.http_method_names = ['get', 'put', 'patch', 'delete']
@@ -0,0 +1,91 @@
+from collections import Counter
+
+from django.conf import settings
+
+
+class QueryBudgetExceeded(Exception):
+    pass
+
+
+class QueryBudget:
+    """
+    Допустимое число SQL-запросов на запрос: queries плюс per_item на
+    каждый объект в ответе (на странице списка).
+    """
+
+    def __init__(self, queries, per_item=0):
+        self.queries = queries
+        self.per_item = per_item
+
+    def limit(self, items):
+        return self.queries + self.per_item * items
+
+    def __repr__(self):
+        return f'QueryBudget({self.queries}, per_item={self.per_item})'
+
+
+def query_budget(budget):
+    """
+    Задаёт бюджет SQL-запросов функции-представлению или классу.
+    Бюджет — число, QueryBudget или словарь {действие: бюджет}, где
+    действие — имя action вьюсета или HTTP-метод в нижнем регистре.
+    Для action с несколькими методами бюджет тоже может быть словарём
+    {метод: бюджет}. Бюджеты включают работу после фиксации транзакции
+    (transaction.on_commit), равны измеренному числу запросов и
+    проверяются тестами api/tests.py. У списков per_item=0: запрос на
+    каждую строку страницы сразу превышает бюджет.
+    Для @api_view декоратор ставится первым.
+    """
+    def decorator(view):
+        view.query_budget = budget
+        return view
+    return decorator
+
+
+def declared_budget(callback, view_name):
+    """Бюджет, объявленный для представления или в QUERY_BUDGETS."""
+    for owner in (callback, getattr(callback, 'cls', None)):
+        budget = getattr(owner, 'query_budget', None)
+        if budget is not None:
+            return budget
+    return settings.QUERY_BUDGETS.get(view_name)
+
+
+def resolve_budget(callback, view_name, method):
+    """QueryBudget для метода запроса или None, если бюджет не задан."""
+    budget = declared_budget(callback, view_name)
+    if isinstance(budget, dict):
+        actions = getattr(callback, 'actions', None) or {}
+        method = method.lower()
+        budget = budget.get(actions.get(method, method))
+        if isinstance(budget, dict):
+            budget = budget.get(method)
+    if isinstance(budget, int):
+        budget = QueryBudget(budget)
+    return budget
+
+
+def response_items(response):
+    """Количество объектов в ответе: длина списка или страницы."""
+    data = getattr(response, 'data', None)
+    if isinstance(data, dict):
+        data = data.get('results')
+    return len(data) if isinstance(data, list) else 0
+
+
+class QueryCapture:
+    """Обёртка execute_wrapper, запоминающая текст запросов."""
+
+    def __init__(self):
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        self.queries.append(sql)
+        return execute(sql, params, many, context)
+
+    def duplicates(self, limit=5):
+        return [
+            (sql, count)
+            for sql, count in Counter(self.queries).most_common(limit)
+            if count > 1
+        ]
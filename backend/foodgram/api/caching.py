@@ -0,0 +1,101 @@
+import time
+
+from django.core.cache import cache, caches
+from django.db import transaction
+
+VERSION_KEY = 'version:{}'
+RECIPE_LIST_VERSION = 'recipes:list'
+RESPONSE_CACHE_STATS_KEY = 'response_cache:{}'
+
+response_cache = caches['responses']
+
+
+def model_version_name(model):
+    return model._meta.label_lower
+
+
+def user_version_name(user_id):
+    """Версия данных, зависящих от действий конкретного пользователя."""
+    return f'user:{user_id}'
+
+
+def _initial_version():
+    # Версия, потерянная при вытеснении из кэша, не должна начинаться
+    # заново с единицы и совпасть с уже закэшированной.
+    return time.time_ns() // 1000
+
+
+def get_version(name):
+    """Текущая версия именованного набора данных."""
+    return get_versions([name])[name]
+
+
+def get_versions(names):
+    """Текущие версии нескольких наборов данных одним обращением к кэшу."""
+    keys = {VERSION_KEY.format(name): name for name in names}
+    versions = cache.get_many(keys)
+    for key in keys.keys() - versions.keys():
+        cache.add(key, _initial_version(), timeout=None)
+        versions[key] = cache.get(key)
+    return {keys[key]: version for key, version in versions.items()}
+
+
+def bump_version(name):
+    """Увеличивает версию, делая недействительными зависящие от неё данные."""
+    key = VERSION_KEY.format(name)
+    try:
+        return cache.incr(key)
+    except ValueError:
+        cache.add(key, _initial_version(), timeout=None)
+        return cache.get(key)
+
+
+def recipe_version_name(recipe_id):
+    return f'recipe:{recipe_id}'
+
+
+def author_recipes_version_name(author_id):
+    return f'recipes:author:{author_id}'
+
+
+def tag_recipes_version_name(slug):
+    return f'recipes:tag:{slug}'
+
+
+def bump_recipe_versions(recipe_id, author_id, tag_slugs):
+    """
+    После фиксации транзакции делает недействительными закэшированные
+    ответы, в которые мог попасть рецепт: его страницу, общий список и
+    списки с фильтром по его автору и тэгам.
+    """
+    names = [
+        RECIPE_LIST_VERSION,
+        recipe_version_name(recipe_id),
+        author_recipes_version_name(author_id),
+    ]
+    names.extend(tag_recipes_version_name(slug) for slug in set(tag_slugs))
+
+    def bump():
+        for name in names:
+            bump_version(name)
+
+    transaction.on_commit(bump)
+
+
+def count_response_cache(event):
+    """Увеличивает счётчик попаданий (hit) или промахов (miss) кэша ответов."""
+    key = RESPONSE_CACHE_STATS_KEY.format(event)
+    try:
+        response_cache.incr(key)
+    except ValueError:
+        if not response_cache.add(key, 1, timeout=None):
+            response_cache.incr(key)
+
+
+def response_cache_stats():
+    keys = {
+        RESPONSE_CACHE_STATS_KEY.format(event): event
+        for event in ('hit', 'miss')
+    }
+    values = response_cache.get_many(keys)
+    return {event: values.get(key, 0) for key, event in keys.items()}
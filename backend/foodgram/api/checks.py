@@ -0,0 +1,23 @@
+from django.conf import settings
+from django.core.checks import Tags, Warning, register
+
+
+@register(Tags.caches)
+def check_shared_cache(app_configs, **kwargs):
+    """
+    С ASYNC_VIEWS часть запросов обслуживает отдельный процесс, поэтому
+    кэш в памяти процесса не даёт ему и gunicorn видеть сброс кэша друг
+    друга.
+    """
+    if not settings.ASYNC_VIEWS:
+        return []
+    return [
+        Warning(
+            f'Кэш {alias} хранится в памяти процесса.',
+            hint='Для ASYNC_VIEWS задайте общий кэш, например Redis '
+                 '(CACHE_BACKEND, RESPONSE_CACHE_BACKEND).',
+            id='api.W001',
+        )
+        for alias, options in settings.CACHES.items()
+        if options['BACKEND'].endswith('.LocMemCache')
+    ]
@@ -1,6 +1,24 @@
+from django import forms
 from django_filters import rest_framework as filters
 
 from recipes.models import Ingredient, Recipe
+from recipes.search import search_recipes
+
+from .queries import filter_by_tags, tag_ids_by_slug
+
+
+class MultipleCharField(forms.Field):
+    widget = forms.MultipleHiddenInput
+
+    def to_python(self, value):
+        if not value:
+            return []
+        return [str(item) for item in value]
+
+
+class MultipleCharFilter(filters.Filter):
+    """Фильтр по нескольким значениям параметра без запроса вариантов."""
+    field_class = MultipleCharField
 
 
 class RecipeFilter(filters.FilterSet):
@@ -9,27 +27,38 @@ class RecipeFilter(filters.FilterSet):
         method='filter_is_in_shopping_cart'
     )
     author = filters.NumberFilter(field_name='author__id')
-    tags = filters.CharFilter(field_name='tags__slug', lookup_expr='exact')
+    tags = MultipleCharFilter(method='filter_tags')
+    search = filters.CharFilter(method='filter_search')
 
     class Meta:
         model = Recipe
-        fields = ['is_favorited', 'is_in_shopping_cart', 'author', 'tags']
+        fields = [
+            'is_favorited', 'is_in_shopping_cart', 'author', 'tags', 'search'
+        ]
 
     def filter_is_favorited(self, queryset, name, value):
-        user = self.request.user
         if value:
-            return queryset.filter(favorite_recipe__user=user)
+            return queryset.filter(is_favorited=True)
         return queryset
 
     def filter_is_in_shopping_cart(self, queryset, name, value):
-        user = self.request.user
         if value:
-            return queryset.filter(shoppingcart_recipe__user=user)
+            return queryset.filter(is_in_shopping_cart=True)
         return queryset
 
+    def filter_tags(self, queryset, name, value):
+        tag_ids_map = tag_ids_by_slug()
+        tag_ids = [
+            tag_id for slug in value for tag_id in tag_ids_map.get(slug, [])
+        ]
+        return filter_by_tags(queryset, tag_ids)
+
+    def filter_search(self, queryset, name, value):
+        return search_recipes(queryset, value)
+
 
 class TagFilter(filters.FilterSet):
-    tags = filters.AllValuesMultipleFilter(field_name='slug')
+    tags = MultipleCharFilter(field_name='slug', lookup_expr='in')
 
 
 class IngredientFilter(filters.FilterSet):
@@ -0,0 +1,73 @@
+import bisect
+import logging
+import threading
+
+from django.db import DatabaseError
+
+from recipes.models import Ingredient
+
+from .caching import get_version, model_version_name
+
+logger = logging.getLogger(__name__)
+
+
+class IngredientIndex:
+    """
+    Отсортированный по casefold(name) индекс ингредиентов в памяти процесса.
+    Поиск по префиксу выполняется бинарным поиском, недостающие до limit
+    позиции добираются совпадениями по подстроке. Индекс перестраивается,
+    когда меняется версия модели Ingredient.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot = None
+
+    def build(self):
+        version = get_version(model_version_name(Ingredient))
+        entries = sorted(
+            (name.casefold(), pk, name, measurement_unit)
+            for pk, name, measurement_unit in Ingredient.objects.values_list(
+                'id', 'name', 'measurement_unit'
+            )
+        )
+        self._snapshot = (version, [entry[0] for entry in entries], entries)
+
+    def warm_up(self):
+        try:
+            self.build()
+        except DatabaseError:
+            logger.warning('Индекс ингредиентов не построен', exc_info=True)
+
+    def get_snapshot(self):
+        version = get_version(model_version_name(Ingredient))
+        snapshot = self._snapshot
+        if snapshot is None or snapshot[0] != version:
+            with self._lock:
+                if self._snapshot is None or self._snapshot[0] != version:
+                    self.build()
+                snapshot = self._snapshot
+        return snapshot
+
+    def search(self, query, limit):
+        _, keys, entries = self.get_snapshot()
+        query = query.casefold()
+        start = bisect.bisect_left(keys, query)
+        end = bisect.bisect_left(keys, query + '\U0010ffff', lo=start)
+        found = entries[start:min(end, start + limit)]
+
+        if len(found) < limit:
+            contains = sorted(
+                (key.find(query), entry)
+                for key, entry in zip(keys, entries)
+                if not key.startswith(query) and query in key
+            )
+            found.extend(entry for _, entry in contains[:limit - len(found)])
+
+        return [
+            {'id': pk, 'name': name, 'measurement_unit': measurement_unit}
+            for _, pk, name, measurement_unit in found
+        ]
+
+
+ingredient_index = IngredientIndex()
@@ -0,0 +1,72 @@
+import os
+
+from prometheus_client import (REGISTRY, CollectorRegistry, Counter,
+                               Histogram, generate_latest, multiprocess)
+from prometheus_client.core import CounterMetricFamily
+
+from .caching import response_cache_stats
+
+LABELS = ('view', 'method')
+
+REQUESTS = Counter(
+    'foodgram_http_requests_total',
+    'Количество запросов.',
+    LABELS + ('status',),
+)
+LATENCY = Histogram(
+    'foodgram_http_request_duration_seconds',
+    'Время обработки запроса.',
+    LABELS,
+    buckets=(.005, .01, .025, .05, .1, .25, .5, 1, 2.5, 5, 10),
+)
+SQL_QUERIES = Histogram(
+    'foodgram_sql_queries_per_request',
+    'Количество SQL-запросов на один запрос.',
+    LABELS,
+    buckets=(0, 1, 2, 3, 5, 8, 13, 21, 34, 55, 89),
+)
+SQL_DURATION = Histogram(
+    'foodgram_sql_duration_seconds_per_request',
+    'Суммарное время SQL-запросов на один запрос.',
+    LABELS,
+    buckets=(.001, .0025, .005, .01, .025, .05, .1, .25, .5, 1, 2.5),
+)
+RESPONSE_SIZE = Histogram(
+    'foodgram_http_response_size_bytes',
+    'Размер тела ответа (без потоковых ответов).',
+    LABELS,
+    buckets=tuple(2 ** power for power in range(8, 24, 2)),
+)
+
+
+class ResponseCacheCollector:
+    """Попадания и промахи кэша ответов для анонимных (api/mixins.py)."""
+
+    def collect(self):
+        metric = CounterMetricFamily(
+            'foodgram_response_cache',
+            'Обращения к кэшу ответов для анонимных пользователей.',
+            labels=('result',),
+        )
+        for result, value in response_cache_stats().items():
+            metric.add_metric((result,), value)
+        yield metric
+
+
+RESPONSE_CACHE_COLLECTOR = ResponseCacheCollector()
+if 'PROMETHEUS_MULTIPROC_DIR' not in os.environ:
+    REGISTRY.register(RESPONSE_CACHE_COLLECTOR)
+
+
+def render():
+    """
+    Метрики в формате Prometheus. При заданной PROMETHEUS_MULTIPROC_DIR
+    значения всех процессов gunicorn собираются из файлов этого каталога.
+    """
+    if 'PROMETHEUS_MULTIPROC_DIR' in os.environ:
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        registry.register(RESPONSE_CACHE_COLLECTOR)
+    else:
+        registry = REGISTRY
+    return generate_latest(registry)
@@ -0,0 +1,389 @@
+import cProfile
+import json
+import logging
+import os
+import random
+import re
+import time
+import traceback
+import uuid
+from collections import Counter
+from contextlib import ExitStack, asynccontextmanager, contextmanager
+from datetime import datetime
+from operator import itemgetter
+from pathlib import Path
+
+from asgiref.sync import (iscoroutinefunction, markcoroutinefunction,
+                          sync_to_async)
+from django.conf import settings
+from django.core.exceptions import MiddlewareNotUsed
+from django.db import connections
+from rest_framework.exceptions import AuthenticationFailed
+from rest_framework.renderers import BrowsableAPIRenderer
+from rest_framework.request import Request
+from rest_framework.settings import api_settings
+
+from . import metrics
+from .budgets import (QueryBudgetExceeded, QueryCapture, resolve_budget,
+                      response_items)
+
+logger = logging.getLogger(__name__)
+
+
+def enter_wrappers(stack, wrapper):
+    for connection in connections.all():
+        stack.enter_context(connection.execute_wrapper(wrapper))
+
+
+@contextmanager
+def wrap_queries(wrapper):
+    """Подключает execute_wrapper ко всем соединениям с базой."""
+    with ExitStack() as stack:
+        enter_wrappers(stack, wrapper)
+        yield
+
+
+@asynccontextmanager
+async def awrap_queries(wrapper):
+    """
+    wrap_queries для асинхронного кода. Соединения у каждого потока
+    свои, поэтому обёртки подключаются в потоке, где sync_to_async
+    выполняет запросы к базе для текущего запроса.
+    """
+    stack = ExitStack()
+    await sync_to_async(enter_wrappers)(stack, wrapper)
+    try:
+        yield
+    finally:
+        await sync_to_async(stack.close)()
+
+
+class QueryStats:
+    """Обёртка execute_wrapper, считающая запросы и их время."""
+
+    def __init__(self):
+        self.count = 0
+        self.duration = 0.0
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.count += 1
+            self.duration += time.perf_counter() - started
+
+
+class MetricsMiddleware:
+    """
+    Метрики запросов по имени URL и методу: количество, время, число и
+    время SQL-запросов, размер ответа. Отдаются по /api/metrics. Для
+    потоковых ответов метрики записываются по окончании передачи.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.METRICS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        queries = QueryStats()
+        started = time.perf_counter()
+        with wrap_queries(queries):
+            response = self.get_response(request)
+        return self.process(request, response, queries, started)
+
+    async def __acall__(self, request):
+        queries = QueryStats()
+        started = time.perf_counter()
+        async with awrap_queries(queries):
+            response = await self.get_response(request)
+        return self.process(request, response, queries, started)
+
+    def process(self, request, response, queries, started):
+        if response.streaming and not response.is_async:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, queries,
+                started,
+            )
+        else:
+            self.observe(request, response, queries, started)
+        return response
+
+    def stream(self, content, request, response, queries, started):
+        try:
+            with wrap_queries(queries):
+                yield from content
+        finally:
+            self.observe(request, response, queries, started)
+
+    @staticmethod
+    def observe(request, response, queries, started):
+        elapsed = time.perf_counter() - started
+        match = request.resolver_match
+        labels = (
+            match.view_name if match is not None else '<unresolved>',
+            request.method,
+        )
+        metrics.REQUESTS.labels(*labels, response.status_code).inc()
+        metrics.LATENCY.labels(*labels).observe(elapsed)
+        metrics.SQL_QUERIES.labels(*labels).observe(queries.count)
+        metrics.SQL_DURATION.labels(*labels).observe(queries.duration)
+        if not response.streaming:
+            metrics.RESPONSE_SIZE.labels(*labels).observe(
+                len(response.content)
+            )
+
+
+class QueryLog:
+    """
+    Обёртка execute_wrapper, записывающая текст, время и место вызова.
+    Параметры (в них бывают токены и личные данные) записываются только
+    при with_params.
+    """
+
+    def __init__(self, with_params=False):
+        self.with_params = with_params
+        self.queries = []
+
+    def __call__(self, execute, sql, params, many, context):
+        started = time.perf_counter()
+        try:
+            return execute(sql, params, many, context)
+        finally:
+            self.queries.append({
+                'sql': sql,
+                'params': repr(params) if self.with_params else None,
+                'many': many,
+                'alias': context['connection'].alias,
+                'duration': time.perf_counter() - started,
+                'origin': query_origin(),
+            })
+
+    def duplicates(self):
+        """
+        Повторяющиеся запросы: одинаковый SQL (кандидаты в N+1) и,
+        отдельно, одинаковые SQL и параметры, если они записывались.
+        """
+        groups = {}
+        for query in self.queries:
+            group = groups.setdefault(query['sql'], {
+                'sql': query['sql'], 'count': 0, 'duration': 0.0,
+                'identical': Counter(), 'origins': Counter(),
+            })
+            group['count'] += 1
+            group['duration'] += query['duration']
+            group['identical'][query['params']] += 1
+            group['origins'][' <- '.join(query['origin'][:3])] += 1
+        return [
+            {
+                'sql': group['sql'],
+                'count': group['count'],
+                'duration': group['duration'],
+                'identical': sum(
+                    count for count in group['identical'].values()
+                    if count > 1
+                ) if self.with_params else None,
+                'origins': dict(group['origins'].most_common()),
+            }
+            for group in sorted(
+                groups.values(), key=itemgetter('count'), reverse=True
+            )
+            if group['count'] > 1
+        ]
+
+
+def query_origin():
+    """Кадры проекта, из которых выполнен запрос, от ближайшего."""
+    base_dir = str(settings.BASE_DIR)
+    return [
+        f'{os.path.relpath(frame.filename, base_dir)}:{frame.lineno} '
+        f'in {frame.name}'
+        for frame in reversed(traceback.extract_stack())
+        if frame.filename.startswith(base_dir)
+        and frame.filename != __file__
+    ]
+
+
+class ProfilingMiddleware:
+    """
+    Профилирование запросов к /api/ через cProfile с журналом SQL.
+    Включается для сотрудников параметром ?_profile=1 или заголовком
+    X-Profile и автоматически для каждого N-го запроса при
+    PROFILING_SAMPLE_RATE. Отчёты (.prof и .json) пишутся в
+    PROFILING_DIR, имя отчёта возвращается в заголовке X-Profile-Report.
+    """
+
+    def __init__(self, get_response):
+        if not settings.PROFILING_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        self.directory = Path(settings.PROFILING_DIR)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.sample_rate = settings.PROFILING_SAMPLE_RATE
+
+    def __call__(self, request):
+        if not request.path.startswith('/api/'):
+            return self.get_response(request)
+        if self.requested(request):
+            if not self.is_staff(request):
+                return self.get_response(request)
+            sampled = False
+        elif self.sample_rate and random.randrange(self.sample_rate) == 0:
+            sampled = True
+        else:
+            return self.get_response(request)
+        return self.profile(request, sampled)
+
+    @staticmethod
+    def requested(request):
+        return (
+            request.GET.get('_profile') == '1'
+            or request.headers.get('X-Profile') == '1'
+        )
+
+    @staticmethod
+    def is_staff(request):
+        """Сотрудник по сессии или по токену, как его определит DRF."""
+        if request.user.is_authenticated:
+            return request.user.is_staff
+        authentication_classes = api_settings.DEFAULT_AUTHENTICATION_CLASSES
+        drf_request = Request(request, authenticators=[
+            authentication() for authentication in authentication_classes
+        ])
+        try:
+            return drf_request.user.is_staff
+        except AuthenticationFailed:
+            return False
+
+    def profile(self, request, sampled):
+        # Проверка прав сотрудника добавляет запрос, бюджет не проверяется.
+        request.profiled = True
+        profiler = cProfile.Profile()
+        try:
+            profiler.enable()
+        except ValueError:
+            # В потоке уже работает другой профилировщик.
+            return self.get_response(request)
+        # Параметры SQL и строка запроса пишутся только в отчёты,
+        # запрошенные сотрудником, но не в выборочные отчёты по запросам
+        # всех пользователей.
+        queries = QueryLog(with_params=not sampled)
+        started = time.perf_counter()
+        try:
+            with wrap_queries(queries):
+                response = self.get_response(request)
+        finally:
+            profiler.disable()
+        elapsed = time.perf_counter() - started
+
+        name = self.report_name(request)
+        profiler.dump_stats(self.directory / f'{name}.prof')
+        report = {
+            'path': request.path if sampled else request.get_full_path(),
+            'method': request.method,
+            'status': response.status_code,
+            'user': str(request.user),
+            'sampled': sampled,
+            'duration': elapsed,
+            'query_count': len(queries.queries),
+            'query_duration': sum(
+                query['duration'] for query in queries.queries
+            ),
+            'duplicates': queries.duplicates(),
+            'queries': queries.queries,
+        }
+        with open(self.directory / f'{name}.json', 'w') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+        if not sampled:
+            response['X-Profile-Report'] = name
+        return response
+
+    @staticmethod
+    def report_name(request):
+        path = re.sub(r'[^\w-]+', '-', request.path).strip('-')
+        stamp = datetime.now().strftime('%Y%m%d-%H%M%S')
+        return f'{stamp}-{request.method}-{path}-{uuid.uuid4().hex[:8]}'
+
+
+class QueryBudgetMiddleware:
+    """
+    Сверяет число SQL-запросов с бюджетом представления (api/budgets.py).
+    При превышении в отладке и тестах выбрасывает QueryBudgetExceeded,
+    иначе пишет предупреждение с повторяющимися запросами. Запросы
+    потоковых ответов учитываются до конца передачи.
+    """
+
+    sync_capable = True
+    async_capable = True
+
+    def __init__(self, get_response):
+        if not settings.QUERY_BUDGETS_ENABLED:
+            raise MiddlewareNotUsed
+        self.get_response = get_response
+        if iscoroutinefunction(get_response):
+            markcoroutinefunction(self)
+
+    def __call__(self, request):
+        if iscoroutinefunction(self):
+            return self.__acall__(request)
+        capture = QueryCapture()
+        with wrap_queries(capture):
+            response = self.get_response(request)
+        return self.process(request, response, capture)
+
+    async def __acall__(self, request):
+        capture = QueryCapture()
+        async with awrap_queries(capture):
+            response = await self.get_response(request)
+        return self.process(request, response, capture)
+
+    def process(self, request, response, capture):
+        if response.streaming and not response.is_async:
+            response.streaming_content = self.stream(
+                response.streaming_content, request, response, capture
+            )
+        else:
+            self.check(request, response, capture)
+        return response
+
+    def stream(self, content, request, response, capture):
+        with wrap_queries(capture):
+            yield from content
+        self.check(request, response, capture)
+
+    @staticmethod
+    def check(request, response, capture):
+        match = request.resolver_match
+        if match is None or getattr(request, 'profiled', False):
+            return
+        # HTML-страница browsable API делает свои запросы (пользователь,
+        # формы) сверх бюджета ответа API.
+        renderer = getattr(response, 'accepted_renderer', None)
+        if isinstance(renderer, BrowsableAPIRenderer):
+            return
+        budget = resolve_budget(match.func, match.view_name, request.method)
+        if budget is None:
+            return
+        limit = budget.limit(response_items(response))
+        if len(capture.queries) <= limit:
+            return
+        message = (
+            f'{request.method} {request.path} ({match.view_name}): '
+            f'{len(capture.queries)} SQL-запросов при бюджете {limit}'
+        )
+        duplicates = capture.duplicates()
+        if duplicates:
+            message += '. Повторы:\n' + '\n'.join(
+                f'{count} x {sql}' for sql, count in duplicates
+            )
+        if settings.QUERY_BUDGETS_RAISE:
+            raise QueryBudgetExceeded(message)
+        logger.warning(message)
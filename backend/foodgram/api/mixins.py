@@ -1,8 +1,181 @@
+import hashlib
+
+from django.conf import settings
+from django.core.cache import cache
+from django.http import Http404, HttpResponse, HttpResponseNotModified
+from django.utils.cache import patch_cache_control, patch_vary_headers
+from django.utils.http import parse_etags, urlencode
 from rest_framework import mixins
+from rest_framework.response import Response
 from rest_framework.viewsets import GenericViewSet
 
+from .caching import (count_response_cache, get_version, get_versions,
+                      model_version_name, response_cache)
+
+
+def render_for_cache(view, request, response):
+    """Рендерит ответ DRF, чтобы сохранить готовое содержимое в кэш."""
+    response.accepted_renderer = request.accepted_renderer
+    response.accepted_media_type = request.accepted_media_type
+    response.renderer_context = view.get_renderer_context()
+    response.render()
+    return response.content, response['Content-Type']
+
+
+def normalized_query(request):
+    return urlencode(sorted(request.query_params.lists()), doseq=True)
+
 
 class ListRetrieveMixin(mixins.ListModelMixin,
                         mixins.RetrieveModelMixin,
                         GenericViewSet):
     pass
+
+
+class VersionedCacheMixin:
+    """
+    Кэширование справочников по версии модели: сильный ETag, ответ
+    304 Not Modified и отрендеренный JSON для каждой комбинации фильтров.
+    Версия увеличивается при сохранении или удалении объектов модели.
+    """
+
+    def perform_authentication(self, request):
+        pass
+
+    def list(self, request, *args, **kwargs):
+        return self.versioned_response(super().list, request, *args, **kwargs)
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.versioned_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def versioned_response(self, handler, request, *args, **kwargs):
+        label = model_version_name(self.queryset.model)
+        key = hashlib.sha1(
+            f'{label}:{get_version(label)}:{request.accepted_renderer.format}:'
+            f'{request.path}?{normalized_query(request)}'.encode()
+        ).hexdigest()
+        etag = f'"{key}"'
+
+        if etag in parse_etags(request.headers.get('If-None-Match', '')):
+            response = HttpResponseNotModified()
+        else:
+            cache_key = f'response:{key}'
+            cached = cache.get(cache_key)
+            if cached is not None:
+                content, content_type = cached
+                response = HttpResponse(content, content_type=content_type)
+            else:
+                response = handler(request, *args, **kwargs)
+                if response.status_code != 200:
+                    return response
+                cache.set(
+                    cache_key,
+                    render_for_cache(self, request, response),
+                    settings.REFERENCE_CACHE_TIMEOUT,
+                )
+
+        response['ETag'] = etag
+        patch_cache_control(
+            response, public=True, max_age=settings.REFERENCE_MAX_AGE
+        )
+        return response
+
+
+class AnonymousResponseCacheMixin:
+    """
+    Кэш готовых ответов list и retrieve для анонимных пользователей по
+    нормализованной строке запроса (get_cache_query). В ключ входят
+    версии, которые возвращает get_cache_dependencies: при изменении любой
+    из них старые ответы больше не читаются. Заголовок X-Cache показывает
+    HIT или MISS.
+    """
+
+    def list(self, request, *args, **kwargs):
+        return self.anonymous_cached_response(
+            super().list, request, *args, **kwargs
+        )
+
+    def retrieve(self, request, *args, **kwargs):
+        return self.anonymous_cached_response(
+            super().retrieve, request, *args, **kwargs
+        )
+
+    def get_cache_dependencies(self, request, *args, **kwargs):
+        raise NotImplementedError
+
+    def get_cache_query(self, request):
+        return normalized_query(request)
+
+    def anonymous_cached_response(self, handler, request, *args, **kwargs):
+        if request.user.is_authenticated:
+            return handler(request, *args, **kwargs)
+
+        names = self.get_cache_dependencies(request, *args, **kwargs)
+        versions = get_versions(names)
+        key = 'anonymous:' + hashlib.sha1('{}:{}:{}?{}'.format(
+            ':'.join(str(versions[name]) for name in names),
+            request.accepted_renderer.format,
+            request.path,
+            self.get_cache_query(request),
+        ).encode()).hexdigest()
+
+        cached = response_cache.get(key)
+        if cached is not None:
+            count_response_cache('hit')
+            content, content_type = cached
+            response = HttpResponse(content, content_type=content_type)
+            response['X-Cache'] = 'HIT'
+        else:
+            count_response_cache('miss')
+            response = handler(request, *args, **kwargs)
+            if response.status_code == 200:
+                response_cache.set(
+                    key,
+                    render_for_cache(self, request, response),
+                    settings.RESPONSE_CACHE_TIMEOUT,
+                )
+            response['X-Cache'] = 'MISS'
+        patch_vary_headers(response, ('Authorization',))
+        return response
+
+
+class ProjectionReadMixin:
+    """
+    Ответы list и retrieve без сериализатора: строки из
+    get_projection_rows превращаются в данные ответа методом
+    represent_rows. Используется, только если use_projection() истинно.
+    """
+
+    def use_projection(self):
+        raise NotImplementedError
+
+    def get_projection_rows(self, queryset):
+        raise NotImplementedError
+
+    def represent_rows(self, rows):
+        raise NotImplementedError
+
+    def list(self, request, *args, **kwargs):
+        if not self.use_projection():
+            return super().list(request, *args, **kwargs)
+        rows = self.get_projection_rows(
+            self.filter_queryset(self.get_queryset())
+        )
+        page = self.paginate_queryset(rows)
+        if page is not None:
+            return self.get_paginated_response(self.represent_rows(page))
+        return Response(self.represent_rows(rows))
+
+    def retrieve(self, request, *args, **kwargs):
+        if not self.use_projection():
+            return super().retrieve(request, *args, **kwargs)
+        lookup_url_kwarg = self.lookup_url_kwarg or self.lookup_field
+        rows = self.get_projection_rows(
+            self.filter_queryset(self.get_queryset())
+        ).filter(**{self.lookup_field: self.kwargs[lookup_url_kwarg]})
+        data = self.represent_rows(rows)
+        if not data:
+            raise Http404
+        return Response(data[0])
@@ -1,7 +1,165 @@
-from rest_framework.pagination import PageNumberPagination
+import hashlib
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from django.conf import settings
+from django.core.cache import cache
+from django.core.paginator import Paginator
+from django.db import connection
+from django.utils.functional import cached_property
+from rest_framework.pagination import CursorPagination, PageNumberPagination
+from rest_framework.response import Response
+
+from .caching import get_versions, model_version_name, user_version_name
+
+
+def estimate_count(model):
+    """
+    Оценка числа строк таблицы по статистике PostgreSQL (pg_class.reltuples).
+    На других СУБД и для ещё не проанализированных таблиц возвращает None.
+    """
+    if connection.vendor != 'postgresql':
+        return None
+    table = model._meta.db_table
+    key = f'count_estimate:{table}'
+    estimate = cache.get(key)
+    if estimate is None:
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'SELECT reltuples::bigint FROM pg_class '
+                'WHERE oid = %s::regclass',
+                [table],
+            )
+            row = cursor.fetchone()
+        estimate = row[0] if row else -1
+        cache.set(key, estimate, settings.PAGINATION_COUNT_TIMEOUT)
+    return estimate if estimate >= 0 else None
+
+
+class CountPaginator(Paginator):
+    """Paginator, получающий количество объектов из внешней функции."""
+
+    def __init__(self, object_list, per_page, get_count, **kwargs):
+        super().__init__(object_list, per_page, **kwargs)
+        self.get_count = get_count
+        self.count_is_exact = True
+
+    @cached_property
+    def count(self):
+        count, self.count_is_exact = self.get_count(self.object_list)
+        return count
 
 
 class PageNumberLimitPagination(PageNumberPagination):
-    """Ограничение количества объектов на стр. посредством параметра limit."""
+    """
+    Ограничение количества объектов на стр. посредством параметра limit.
+    Количество объектов кэшируется по набору фильтров и пользователю и
+    сбрасывается при изменении версии модели или данных пользователя.
+    При estimate_unfiltered_count для списка без фильтров на PostgreSQL
+    используется оценка по статистике таблицы.
+    """
     page_query_param = 'page'
     page_size_query_param = 'limit'
+    estimate_unfiltered_count = False
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.request = request
+        return super().paginate_queryset(queryset, request, view)
+
+    def django_paginator_class(self, object_list, per_page):
+        return CountPaginator(object_list, per_page, self.get_count)
+
+    def get_filter_params(self):
+        ignored = {self.page_query_param, self.page_size_query_param, 'format'}
+        return sorted(
+            (key, value)
+            for key, values in self.request.query_params.lists()
+            if key not in ignored
+            for value in values
+        )
+
+    def get_count_cache_key(self, queryset, filter_params):
+        user = self.request.user
+        names = [model_version_name(queryset.model)]
+        if user.is_authenticated:
+            names.append(user_version_name(user.pk))
+        versions = get_versions(names)
+        raw = '{}?{}:{}:{}'.format(
+            self.request.path,
+            urlencode(filter_params),
+            user.pk,
+            ':'.join(str(versions[name]) for name in names),
+        )
+        return 'count:' + hashlib.sha1(raw.encode()).hexdigest()
+
+    def get_count(self, queryset):
+        """Возвращает количество объектов и признак того, что оно точное."""
+        filter_params = self.get_filter_params()
+        if self.estimate_unfiltered_count and not filter_params:
+            estimate = estimate_count(queryset.model)
+            if (
+                estimate is not None
+                and estimate >= settings.PAGINATION_COUNT_ESTIMATE_THRESHOLD
+            ):
+                return estimate, False
+        key = self.get_count_cache_key(queryset, filter_params)
+        count = cache.get(key)
+        if count is None:
+            count = queryset.count()
+            cache.set(key, count, settings.PAGINATION_COUNT_TIMEOUT)
+        return count, True
+
+    def get_paginated_response(self, data):
+        return Response(OrderedDict([
+            ('count', self.page.paginator.count),
+            ('count_is_exact', self.page.paginator.count_is_exact),
+            ('next', self.get_next_link()),
+            ('previous', self.get_previous_link()),
+            ('results', data)
+        ]))
+
+    def get_paginated_response_schema(self, schema):
+        response_schema = super().get_paginated_response_schema(schema)
+        response_schema['properties'] = OrderedDict(
+            count=response_schema['properties'].pop('count'),
+            count_is_exact={'type': 'boolean', 'example': True},
+            **response_schema['properties'],
+        )
+        return response_schema
+
+
+class CursorLimitPagination(CursorPagination):
+    """Курсорная пагинация по индексированному ключу, без COUNT и OFFSET."""
+    page_size = 10
+    page_size_query_param = 'limit'
+    ordering = '-id'
+
+
+class PageNumberOrCursorPagination(PageNumberLimitPagination):
+    """
+    Пагинация page/limit по умолчанию. Если передан параметр cursor
+    (в том числе пустой, для первой страницы), используется курсорная
+    пагинация с сортировкой по cursor_ordering.
+    """
+    cursor_ordering = '-id'
+    estimate_unfiltered_count = True
+
+    def paginate_queryset(self, queryset, request, view=None):
+        self.cursor_paginator = None
+        if CursorLimitPagination.cursor_query_param in request.query_params:
+            self.cursor_paginator = CursorLimitPagination()
+            self.cursor_paginator.ordering = self.cursor_ordering
+            return self.cursor_paginator.paginate_queryset(
+                queryset, request, view
+            )
+        return super().paginate_queryset(queryset, request, view)
+
+    def get_paginated_response(self, data):
+        if self.cursor_paginator is not None:
+            return self.cursor_paginator.get_paginated_response(data)
+        return super().get_paginated_response(data)
+
+
+class FollowingUsersPagination(PageNumberOrCursorPagination):
+    cursor_ordering = 'username'
+    estimate_unfiltered_count = False
@@ -0,0 +1,112 @@
+from operator import itemgetter
+
+from django.core.exceptions import ImproperlyConfigured
+from django.core.files.storage import default_storage
+
+from recipes.models import IngredientInRecipe, Recipe
+
+from .serializers import RecipeSerializer, UserSerializer, image_variant_urls
+
+# Колонки, которые выбираются из рецептов одним запросом .values().
+RECIPE_COLUMNS = (
+    'id', 'name', 'text', 'cooking_time', 'image', 'image_variants',
+    'image_status', 'favorites_count', 'shopping_carts_count',
+    'is_favorited', 'is_in_shopping_cart', 'author_is_subscribed',
+    'author_id', 'author__email', 'author__username', 'author__first_name',
+    'author__last_name', 'author__recipes_count', 'author__followers_count',
+)
+
+AUTHOR_PLAN = (
+    ('email', itemgetter('author__email')),
+    ('id', itemgetter('author_id')),
+    ('username', itemgetter('author__username')),
+    ('first_name', itemgetter('author__first_name')),
+    ('last_name', itemgetter('author__last_name')),
+    ('is_subscribed', itemgetter('author_is_subscribed')),
+    ('recipes_count', itemgetter('author__recipes_count')),
+    ('followers_count', itemgetter('author__followers_count')),
+)
+
+
+class Projection:
+    """Связанные данные страницы, общие для всех строк."""
+
+    def __init__(self, rows, request):
+        self.request = request
+        recipe_ids = [row['id'] for row in rows]
+        self.tags = {}
+        for recipe_id, *tag in Recipe.tags.through.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('tag__name', 'tag__id').values_list(
+            'recipe_id', 'tag__id', 'tag__name', 'tag__color', 'tag__slug'
+        ):
+            self.tags.setdefault(recipe_id, []).append(
+                dict(zip(('id', 'name', 'color', 'slug'), tag))
+            )
+        self.ingredients = {}
+        for recipe_id, *ingredient in IngredientInRecipe.objects.filter(
+            recipe_id__in=recipe_ids
+        ).order_by('recipe_id', 'ingredient_id').values_list(
+            'recipe_id', 'ingredient_id', 'ingredient__name',
+            'ingredient__measurement_unit', 'amount'
+        ):
+            self.ingredients.setdefault(recipe_id, []).append(
+                dict(zip(('id', 'name', 'measurement_unit', 'amount'),
+                         ingredient))
+            )
+
+    def image_url(self, name):
+        if not name:
+            return None
+        url = default_storage.url(name)
+        if self.request is None:
+            return url
+        return self.request.build_absolute_uri(url)
+
+
+RECIPE_PLAN = (
+    ('id', lambda row, page: row['id']),
+    ('tags', lambda row, page: page.tags.get(row['id'], [])),
+    ('author', lambda row, page: {
+        key: get(row) for key, get in AUTHOR_PLAN
+    }),
+    ('ingredients', lambda row, page: page.ingredients.get(row['id'], [])),
+    ('is_favorited', lambda row, page: row['is_favorited']),
+    ('is_in_shopping_cart', lambda row, page: row['is_in_shopping_cart']),
+    ('image', lambda row, page: page.image_url(row['image'])),
+    ('images', lambda row, page: image_variant_urls(
+        row['image'], row['image_variants'], page.request
+    )),
+    ('image_status', lambda row, page: row['image_status']),
+    ('name', lambda row, page: row['name']),
+    ('text', lambda row, page: row['text']),
+    ('cooking_time', lambda row, page: row['cooking_time']),
+    ('favorites_count', lambda row, page: row['favorites_count']),
+    ('shopping_carts_count', lambda row, page: row['shopping_carts_count']),
+)
+
+# План обязан повторять поля сериализаторов: ответы должны совпадать
+# байт в байт.
+if (
+    tuple(key for key, _ in RECIPE_PLAN) != RecipeSerializer.Meta.fields
+    or tuple(key for key, _ in AUTHOR_PLAN) != UserSerializer.Meta.fields
+):
+    raise ImproperlyConfigured(
+        'RECIPE_PLAN и AUTHOR_PLAN не совпадают с полями RecipeSerializer '
+        'и UserSerializer.'
+    )
+
+
+def recipe_rows(queryset):
+    """Рецепты из recipes_for_read в виде словарей колонок RECIPE_COLUMNS."""
+    return queryset.prefetch_related(None).values(*RECIPE_COLUMNS)
+
+
+def represent_recipes(rows, request):
+    """
+    Представление рецептов, совпадающее с RecipeSerializer(many=True),
+    без создания моделей и полей сериализатора.
+    """
+    rows = list(rows)
+    page = Projection(rows, request)
+    return [{key: get(row, page) for key, get in RECIPE_PLAN} for row in rows]
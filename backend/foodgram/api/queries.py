@@ -0,0 +1,112 @@
+from django.conf import settings
+from django.core.cache import cache
+from django.db.models import BooleanField, Exists, OuterRef, Prefetch, Value
+
+from recipes.models import (Favorite, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
+from users.models import CustomUser, Follower
+
+from .caching import get_version, model_version_name
+
+
+def annotate_user_flags(queryset, user):
+    """
+    Добавляет к рецептам флаги is_favorited, is_in_shopping_cart и
+    author_is_subscribed для текущего пользователя.
+    """
+    if not user.is_authenticated:
+        false = Value(False, output_field=BooleanField())
+        return queryset.annotate(
+            is_favorited=false,
+            is_in_shopping_cart=false,
+            author_is_subscribed=false,
+        )
+    return queryset.annotate(
+        is_favorited=Exists(
+            Favorite.objects.filter(user=user, recipe=OuterRef('pk'))
+        ),
+        is_in_shopping_cart=Exists(
+            ShoppingCart.objects.filter(user=user, recipe=OuterRef('pk'))
+        ),
+        author_is_subscribed=Exists(
+            Follower.objects.filter(
+                followed_user=user, following_user=OuterRef('author')
+            )
+        ),
+    )
+
+
+def recipe_prefetches():
+    """Тэги и ингредиенты рецептов в порядке ответа API."""
+    return (
+        Prefetch('tags', queryset=Tag.objects.order_by('name', 'id')),
+        Prefetch(
+            'ingredient_amount',
+            queryset=IngredientInRecipe.objects.select_related(
+                'ingredient'
+            ).order_by('recipe_id', 'ingredient_id'),
+        ),
+    )
+
+
+def recipes_for_read(user):
+    """
+    Рецепты для списка и детального просмотра: количество запросов
+    на страницу не зависит от её размера.
+    """
+    queryset = Recipe.objects.select_related('author').prefetch_related(
+        *recipe_prefetches()
+    )
+    return annotate_user_flags(queryset, user)
+
+
+def following_users_for(user, recipes_limit=None):
+    """
+    Авторы, на которых подписан пользователь, с первыми recipes_limit
+    рецептами каждого: превью для всей страницы загружается одним
+    запросом с ROW_NUMBER() OVER (PARTITION BY author_id).
+    """
+    recipes = Recipe.objects.all()
+    if recipes_limit is not None:
+        recipes = recipes[:recipes_limit]
+    return CustomUser.objects.filter(
+        id__in=user.following.values('following_user')
+    ).order_by('username').prefetch_related(
+        Prefetch('user_recipes', queryset=recipes, to_attr='recipes_preview')
+    )
+
+
+def shopping_list_for(user):
+    """
+    Список покупок пользователя: кортежи (название, единица измерения,
+    количество) из предрассчитанной таблицы ShoppingListItem.
+    """
+    return ShoppingListItem.objects.filter(user=user).values_list(
+        'ingredient__name',
+        'ingredient__measurement_unit',
+        'total_amount',
+    ).order_by('ingredient__name', 'ingredient__measurement_unit')
+
+
+def tag_ids_by_slug():
+    """Соответствие slug → id тэгов, кэшируемое по версии модели Tag."""
+    key = f'tag_ids_by_slug:{get_version(model_version_name(Tag))}'
+    mapping = cache.get(key)
+    if mapping is None:
+        mapping = {}
+        for slug, tag_id in Tag.objects.values_list('slug', 'id'):
+            mapping.setdefault(slug, []).append(tag_id)
+        cache.set(key, mapping, settings.REFERENCE_CACHE_TIMEOUT)
+    return mapping
+
+
+def filter_by_tags(queryset, tag_ids):
+    """
+    Рецепты, у которых есть хотя бы один из тэгов. Подзапрос EXISTS по
+    промежуточной таблице не размножает строки и не требует DISTINCT.
+    """
+    return queryset.filter(Exists(
+        Recipe.tags.through.objects.filter(
+            recipe_id=OuterRef('pk'), tag_id__in=tag_ids
+        )
+    ))
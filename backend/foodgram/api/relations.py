@@ -0,0 +1,34 @@
+from django.utils.functional import cached_property
+
+
+class SubscriptionResolver:
+    """
+    Подписки текущего пользователя: id авторов загружаются одним запросом
+    при первом обращении и переиспользуются всеми сериализаторами запроса.
+    """
+
+    def __init__(self, user):
+        self.user = user
+
+    @cached_property
+    def following_ids(self):
+        if not self.user.is_authenticated:
+            return frozenset()
+        return frozenset(
+            self.user.following.values_list('following_user_id', flat=True)
+        )
+
+    def is_subscribed(self, user_id):
+        return user_id in self.following_ids
+
+    def invalidate(self):
+        self.__dict__.pop('following_ids', None)
+
+
+def get_subscription_resolver(request):
+    """Возвращает резолвер подписок, привязанный к запросу."""
+    resolver = getattr(request, '_subscription_resolver', None)
+    if resolver is None:
+        resolver = SubscriptionResolver(request.user)
+        request._subscription_resolver = resolver
+    return resolver
@@ -0,0 +1,67 @@
+import csv
+import io
+import json
+
+from rest_framework import renderers
+
+
+class ShoppingListRenderer(renderers.BaseRenderer):
+    """
+    Базовый рендерер списка покупок. Строки (название, единица измерения,
+    количество) отдаются генератором stream для StreamingHttpResponse.
+    """
+    charset = 'utf-8'
+
+    def render(self, data, accepted_media_type=None, renderer_context=None):
+        if isinstance(data, dict):
+            return '\n'.join(
+                f'{key}: {value}' for key, value in data.items()
+            ).encode(self.charset)
+        return ''.join(self.stream(data)).encode(self.charset)
+
+    def stream(self, rows):
+        raise NotImplementedError
+
+
+class ShoppingListTextRenderer(ShoppingListRenderer):
+    media_type = 'text/plain'
+    format = 'txt'
+
+    def stream(self, rows):
+        for name, measurement_unit, amount in rows:
+            yield f'{name}: {amount} {measurement_unit}\n'
+
+
+class ShoppingListCSVRenderer(ShoppingListRenderer):
+    media_type = 'text/csv'
+    format = 'csv'
+
+    def stream(self, rows):
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        writer.writerow(('name', 'measurement_unit', 'amount'))
+        for row in rows:
+            writer.writerow(row)
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate()
+        yield buffer.getvalue()
+
+
+class ShoppingListJSONRenderer(ShoppingListRenderer):
+    media_type = 'application/json'
+    format = 'json'
+
+    def stream(self, rows):
+        separator = '['
+        for name, measurement_unit, amount in rows:
+            yield separator + json.dumps(
+                {
+                    'name': name,
+                    'measurement_unit': measurement_unit,
+                    'amount': amount,
+                },
+                ensure_ascii=False,
+            )
+            separator = ','
+        yield '[]' if separator == '[' else ']'
@@ -1,32 +1,134 @@
 import base64
+import binascii
+import tempfile
 
 import djoser.serializers as djs
 from django.conf import settings
-from django.core.files.base import ContentFile
+from django.core.files import File
+from django.core.files.storage import default_storage
 from django.db import transaction
 from rest_framework import serializers
 
+from recipes import shopping_list
+from recipes.image_processing import schedule_image_processing
+from recipes.images import WEBP_SUFFIX, store_upload
 from recipes.models import (Ingredient, IngredientInRecipe, Recipe,
                             Tag)
 from users.models import CustomUser
 
+from .caching import bump_recipe_versions
+from .relations import get_subscription_resolver
+
+
+def set_prefetched(instance, name, objects):
+    """
+    Кладёт уже известные связанные объекты в кэш prefetch_related, чтобы
+    сериализатор чтения не запрашивал их повторно. Порядок тот же, что
+    при выборке из базы в recipes_for_read.
+    """
+    objects = list(objects)
+    if name == 'tags':
+        objects.sort(key=lambda tag: (tag.name, tag.id))
+    elif name == 'ingredient_amount':
+        objects.sort(key=lambda row: row.ingredient_id)
+    cache = instance.__dict__.setdefault('_prefetched_objects_cache', {})
+    cache.pop(name, None)
+    queryset = getattr(instance, name).all()
+    queryset._result_cache = objects
+    queryset._prefetch_done = True
+    cache[name] = queryset
+
 
 class Base64ImageField(serializers.ImageField):
+    """
+    Картинка в base64. Размер проверяется до декодирования, а сами данные
+    декодируются частями во временный файл.
+    """
+    default_error_messages = {
+        'too_large': 'Размер картинки не должен превышать {max_size} байт.',
+        'invalid_base64': 'Некорректные данные картинки.',
+    }
+    decode_chunk_size = 64 * 1024
+
     def to_internal_value(self, data):
         if isinstance(data, str) and data.startswith('data:image'):
-            format, imgstr = data.split(';base64,')
+            try:
+                format, imgstr = data.split(';base64,')
+            except ValueError:
+                self.fail('invalid_base64')
             ext = format.split('/')[-1]
-            data = ContentFile(base64.b64decode(imgstr), name='temp.' + ext)
+            data = self.decode(imgstr, ext)
+        elif getattr(data, 'size', 0) > settings.IMAGE_MAX_UPLOAD_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_MAX_UPLOAD_SIZE)
         return super().to_internal_value(data)
 
+    def decode(self, imgstr, ext):
+        decoded_size = len(imgstr) * 3 // 4 - imgstr[-2:].count('=')
+        if decoded_size > settings.IMAGE_MAX_UPLOAD_SIZE:
+            self.fail('too_large', max_size=settings.IMAGE_MAX_UPLOAD_SIZE)
+
+        file = tempfile.SpooledTemporaryFile(
+            max_size=settings.FILE_UPLOAD_MAX_MEMORY_SIZE
+        )
+        try:
+            for start in range(0, len(imgstr), self.decode_chunk_size):
+                file.write(base64.b64decode(
+                    imgstr[start:start + self.decode_chunk_size]
+                ))
+        except binascii.Error:
+            file.close()
+            self.fail('invalid_base64')
+        file.seek(0)
+        return File(file, name=f'image.{ext}')
+
+
+def image_variant_urls(image_name, image_variants, request):
+    """
+    Ссылки на уменьшенные копии картинки. Пока копии не готовы, для всех
+    вариантов отдаётся исходная картинка.
+    """
+    if not image_name:
+        return None
+    names = image_variants or {
+        key: image_name
+        for variant in settings.IMAGE_VARIANTS
+        for key in (variant, variant + WEBP_SUFFIX)
+    }
+    urls = {}
+    for variant, name in names.items():
+        url = default_storage.url(name)
+        urls[variant] = (
+            request.build_absolute_uri(url) if request is not None
+            else url
+        )
+    return urls
+
+
+class ImageVariantsField(serializers.Field):
+    """Ссылки на уменьшенные копии картинки рецепта."""
+
+    def __init__(self, **kwargs):
+        kwargs['source'] = '*'
+        kwargs['read_only'] = True
+        super().__init__(**kwargs)
+
+    def to_representation(self, recipe):
+        return image_variant_urls(
+            recipe.image.name, recipe.image_variants,
+            self.context.get('request')
+        )
+
 
 class ShortRecipeSerializer(serializers.ModelSerializer):
+    images = ImageVariantsField()
+
     class Meta:
         model = Recipe
         fields = (
             'id',
             'name',
             'image',
+            'images',
             'cooking_time',
         )
 
@@ -43,14 +145,17 @@ class UserSerializer(djs.UserSerializer):
             'first_name',
             'last_name',
             'is_subscribed',
+            'recipes_count',
+            'followers_count',
         )
+        read_only_fields = ('recipes_count', 'followers_count')
         ref_name = 'CustomUserSerializer'
 
     def get_is_subscribed(self, obj):
+        if hasattr(obj, 'is_subscribed'):
+            return obj.is_subscribed
         request = self.context['request']
-        if request.user.is_authenticated:
-            return obj.followers.filter(following_user=request.user).exists()
-        return False
+        return get_subscription_resolver(request).is_subscribed(obj.id)
 
 
 class UserCreateSerializer(djs.UserCreateSerializer):
@@ -68,22 +173,26 @@ class UserCreateSerializer(djs.UserCreateSerializer):
 
 class FollowingUserSerializer(UserSerializer):
     recipes = serializers.SerializerMethodField()
-    recipes_count = serializers.SerializerMethodField()
 
     class Meta(UserSerializer.Meta):
-        fields = UserSerializer.Meta.fields + ('recipes', 'recipes_count',)
+        fields = UserSerializer.Meta.fields + ('recipes',)
+
+    def get_is_subscribed(self, obj):
+        if 'is_subscribed' in self.context:
+            return self.context['is_subscribed']
+        return super().get_is_subscribed(obj)
 
     def get_recipes(self, obj):
-        recipes_limit = self.context.get('recipes_limit')
-        recipes = obj.user_recipes.all()
+        if hasattr(obj, 'recipes_preview'):
+            recipes = obj.recipes_preview
+        else:
+            recipes_limit = self.context.get('recipes_limit')
+            recipes = obj.user_recipes.all()[:recipes_limit]
         serializer = ShortRecipeSerializer(
-            recipes[:recipes_limit], many=True, context=self.context
+            recipes, many=True, context=self.context
         )
         return serializer.data
 
-    def get_recipes_count(self, obj):
-        return obj.user_recipes.all().count()
-
 
 class TagSerializer(serializers.ModelSerializer):
     class Meta:
@@ -139,40 +248,178 @@ class RecipeWriteSerializer(serializers.ModelSerializer):
         )
         read_only_fields = ('author',)
 
-    def create_or_update_ingredients(self, recipe, ingredients_data):
-        recipe.ingredient_amount.all().delete()
+    def validate_tags(self, value):
+        """
+        Убирает повторяющиеся тэги и упорядочивает их так же, как при
+        чтении рецепта: по названию и id.
+        """
+        return sorted(
+            {tag.id: tag for tag in value}.values(),
+            key=lambda tag: (tag.name, tag.id),
+        )
 
-        new_ingredients = [
+    def validate_ingredients(self, value):
+        """
+        Объединяет повторяющиеся ингредиенты, суммируя количество, и
+        загружает все ингредиенты одним запросом: они же используются
+        в ответе без повторного чтения из базы.
+        """
+        amounts = {}
+        for item in value:
+            amounts[item['id']] = amounts.get(item['id'], 0) + item['amount']
+        if any(amount > settings.INT_MAX_VALUE for amount in amounts.values()):
+            raise serializers.ValidationError(
+                f'Суммарное количество ингредиента не может быть больше '
+                f'{settings.INT_MAX_VALUE}'
+            )
+        ingredients = Ingredient.objects.in_bulk(list(amounts))
+        missing = [
+            ingredient_id for ingredient_id in amounts
+            if ingredient_id not in ingredients
+        ]
+        if missing:
+            raise serializers.ValidationError(
+                f'Ингредиенты не найдены: {", ".join(map(str, missing))}'
+            )
+        return [
+            {
+                'id': ingredient_id,
+                'amount': amount,
+                'ingredient': ingredients[ingredient_id],
+            }
+            for ingredient_id, amount in amounts.items()
+        ]
+
+    def create_or_update_ingredients(self, recipe, ingredients_data,
+                                     created=False):
+        """
+        Приводит ингредиенты рецепта к ingredients_data, выполняя только
+        нужные delete, bulk_update и bulk_create, и пересчитывает списки
+        покупок по изменившимся ингредиентам. Итоговые строки кладутся
+        в кэш prefetch рецепта.
+        """
+        amounts = {item['id']: item['amount'] for item in ingredients_data}
+        ingredients = {
+            item['id']: item['ingredient'] for item in ingredients_data
+        }
+        existing = {}
+        to_delete = []
+        to_update = []
+        changed_ids = set()
+        if not created:
+            for row in recipe.ingredient_amount.all():
+                if (
+                    row.ingredient_id not in amounts
+                    or row.ingredient_id in existing
+                ):
+                    to_delete.append(row.pk)
+                    changed_ids.add(row.ingredient_id)
+                    continue
+                row.ingredient = ingredients[row.ingredient_id]
+                existing[row.ingredient_id] = row
+                if row.amount != amounts[row.ingredient_id]:
+                    row.amount = amounts[row.ingredient_id]
+                    to_update.append(row)
+                    changed_ids.add(row.ingredient_id)
+        to_create = [
             IngredientInRecipe(
                 recipe=recipe,
-                ingredient_id=ingredient_data['id'],
-                amount=ingredient_data['amount']
-            ) for ingredient_data in ingredients_data
+                ingredient=ingredients[ingredient_id],
+                amount=amount,
+            )
+            for ingredient_id, amount in amounts.items()
+            if ingredient_id not in existing
         ]
+        changed_ids.update(row.ingredient_id for row in to_create)
+
+        if to_delete:
+            IngredientInRecipe.objects.filter(pk__in=to_delete).delete()
+        if to_update:
+            IngredientInRecipe.objects.bulk_update(to_update, ['amount'])
+        if to_create:
+            IngredientInRecipe.objects.bulk_create(to_create)
+
+        if changed_ids and not created:
+            shopping_list.refresh_for_recipe(recipe, None, changed_ids)
 
-        IngredientInRecipe.objects.bulk_create(new_ingredients)
+        set_prefetched(
+            recipe, 'ingredient_amount', list(existing.values()) + to_create
+        )
+
+    def update_tags(self, recipe, tags_data, current):
+        """Меняет тэги рецепта, только если набор действительно изменился."""
+        new = {tag.id for tag in tags_data}
+        if current - new:
+            recipe.tags.remove(*(current - new))
+        if new - current:
+            recipe.tags.add(*(new - current))
+        set_prefetched(recipe, 'tags', tags_data)
+
+    def save_image(self, validated_data):
+        image = validated_data.get('image')
+        if image is None:
+            return None
+        validated_data['image'] = store_upload(image)
+        validated_data['image_variants'] = {}
+        validated_data['image_status'] = Recipe.ImageStatus.PROCESSING
+        return validated_data['image']
 
     def create(self, validated_data):
+        upload_name = self.save_image(validated_data)
         tags_data = validated_data.pop('tags')
         ingredients_data = validated_data.pop('ingredients')
 
         with transaction.atomic():
             recipe = Recipe.objects.create(**validated_data)
-            recipe.tags.set(tags_data)
-
-            self.create_or_update_ingredients(recipe, ingredients_data)
-
+            recipe.tags.add(*tags_data)
+            set_prefetched(recipe, 'tags', tags_data)
+
+            self.create_or_update_ingredients(
+                recipe, ingredients_data, created=True
+            )
+            if upload_name:
+                schedule_image_processing(recipe.pk, upload_name)
+            bump_recipe_versions(
+                recipe.pk, recipe.author_id, (tag.slug for tag in tags_data)
+            )
+            # recipes_count увеличен в базе сигналом, берём его оттуда.
+            recipe.author.refresh_from_db(fields=['recipes_count'])
+
+        # Новый рецепт ещё никто не добавил в избранное и корзину, на себя
+        # автор подписаться не может.
+        recipe.is_favorited = False
+        recipe.is_in_shopping_cart = False
+        recipe.author_is_subscribed = False
         return recipe
 
     def update(self, instance, validated_data):
-        tags_data = validated_data.pop('tags', instance.tags.all())
-        ingredients_data = validated_data.pop('ingredients', [])
+        upload_name = self.save_image(validated_data)
+        tags_data = validated_data.pop('tags', None)
+        ingredients_data = validated_data.pop('ingredients', None)
 
         with transaction.atomic():
+            old_tags = list(instance.tags.all())
             instance = super().update(instance, validated_data)
-            instance.tags.set(tags_data)
-
-            self.create_or_update_ingredients(instance, ingredients_data)
+            tag_slugs = [tag.slug for tag in old_tags]
+            if tags_data is None:
+                set_prefetched(instance, 'tags', old_tags)
+            else:
+                self.update_tags(
+                    instance, tags_data, {tag.id for tag in old_tags}
+                )
+                tag_slugs.extend(tag.slug for tag in tags_data)
+            if ingredients_data is None:
+                set_prefetched(
+                    instance, 'ingredient_amount',
+                    instance.ingredient_amount.select_related('ingredient')
+                )
+            else:
+                self.create_or_update_ingredients(instance, ingredients_data)
+            if upload_name:
+                schedule_image_processing(instance.pk, upload_name)
+            bump_recipe_versions(
+                instance.pk, instance.author_id, tag_slugs
+            )
 
         return instance
 
@@ -186,6 +433,7 @@ class RecipeSerializer(serializers.ModelSerializer):
         source='ingredient_amount', many=True
     )
     author = UserSerializer(read_only=True)
+    images = ImageVariantsField()
 
     class Meta:
         model = Recipe
@@ -197,19 +445,35 @@ class RecipeSerializer(serializers.ModelSerializer):
             'is_favorited',
             'is_in_shopping_cart',
             'image',
+            'images',
+            'image_status',
             'name',
             'text',
             'cooking_time',
+            'favorites_count',
+            'shopping_carts_count',
+        )
+        read_only_fields = (
+            'author', 'is_favorited', 'is_in_shopping_cart', 'image_status',
+            'favorites_count', 'shopping_carts_count',
         )
-        read_only_fields = ('author', 'is_favorited', 'is_in_shopping_cart',)
+
+    def to_representation(self, instance):
+        if hasattr(instance, 'author_is_subscribed'):
+            instance.author.is_subscribed = instance.author_is_subscribed
+        return super().to_representation(instance)
 
     def get_is_favorited(self, obj):
+        if hasattr(obj, 'is_favorited'):
+            return obj.is_favorited
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.favorite_recipe.filter(user=user).exists()
         return False
 
     def get_is_in_shopping_cart(self, obj):
+        if hasattr(obj, 'is_in_shopping_cart'):
+            return obj.is_in_shopping_cart
         user = self.context['request'].user
         if user.is_authenticated:
             return obj.shoppingcart_recipe.filter(user=user).exists()
@@ -0,0 +1,56 @@
+from django.db.models.signals import (m2m_changed, post_delete, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import CustomUser, Follower
+
+from .caching import (bump_recipe_versions, bump_version, model_version_name,
+                      user_version_name)
+
+
+@receiver(post_save, sender=Tag)
+@receiver(post_delete, sender=Tag)
+@receiver(post_save, sender=Ingredient)
+@receiver(post_delete, sender=Ingredient)
+@receiver(post_save, sender=Recipe)
+@receiver(post_delete, sender=Recipe)
+def bump_reference_version(sender, **kwargs):
+    bump_version(model_version_name(sender))
+
+
+@receiver(m2m_changed, sender=Recipe.tags.through)
+def bump_recipe_version(sender, action, **kwargs):
+    if action.startswith('post_'):
+        bump_version(model_version_name(Recipe))
+
+
+@receiver(pre_delete, sender=Recipe)
+def invalidate_recipe_responses(sender, instance, **kwargs):
+    bump_recipe_versions(
+        instance.pk, instance.author_id,
+        instance.tags.values_list('slug', flat=True)
+    )
+
+
+@receiver(post_save, sender=CustomUser)
+@receiver(post_delete, sender=CustomUser)
+def bump_user_model_version(sender, created=True, **kwargs):
+    # Вход в систему сохраняет last_login, количество пользователей
+    # при этом не меняется.
+    if created:
+        bump_version(model_version_name(sender))
+
+
+@receiver(post_save, sender=Favorite)
+@receiver(post_delete, sender=Favorite)
+@receiver(post_save, sender=ShoppingCart)
+@receiver(post_delete, sender=ShoppingCart)
+def bump_user_version(sender, instance, **kwargs):
+    bump_version(user_version_name(instance.user_id))
+
+
+@receiver(post_save, sender=Follower)
+@receiver(post_delete, sender=Follower)
+def bump_follower_version(sender, instance, **kwargs):
+    bump_version(user_version_name(instance.followed_user_id))
@@ -0,0 +1,894 @@
+import base64
+import re
+import shutil
+import tempfile
+from contextlib import contextmanager
+from io import StringIO
+from itertools import product
+from pathlib import Path
+from types import SimpleNamespace
+from unittest.mock import patch
+
+from asgiref.sync import sync_to_async
+
+from django.conf import settings as django_settings
+from django.contrib.auth.models import AnonymousUser
+from django.contrib.auth.tokens import default_token_generator
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.core.management import call_command
+from django.db import connection, transaction
+from django.test import AsyncClient, TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import URLResolver, include, re_path, resolve
+from django.utils.datastructures import MultiValueDict
+from djoser.utils import encode_uid
+from rest_framework.authtoken.models import Token
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIClient, APIRequestFactory
+
+from api import metrics, urls
+from api.budgets import QueryBudgetExceeded, resolve_budget, response_items
+from api.filters import RecipeFilter
+from api.projections import recipe_rows, represent_recipes
+from api.queries import (following_users_for, recipes_for_read,
+                         shopping_list_for)
+from api.serializers import RecipeSerializer, ShortRecipeSerializer
+from api.views import RecipeViewSet
+from recipes import shopping_list
+from recipes.image_processing import ImageProcessingPool
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
+from users.models import CustomUser, Follower
+
+PNG = base64.b64decode(
+    'iVBORw0KGgoAAAANSUhEUgAAAAEAAAABCAYAAAAfFcSJAAAADUlEQVR42mNkYPhfDwAC'
+    'hwGA60e6kgAAAABJRU5ErkJggg=='
+)
+MEDIA_ROOT = tempfile.mkdtemp()
+PASSWORD = 'Member-12345'
+METHODS = ('get', 'post', 'put', 'patch', 'delete')
+
+
+def routes(patterns, prefix=''):
+    """
+    Маршруты api/urls.py в порядке разрешения: (шаблон, имя, callback).
+    Варианты с суффиксом формата и перекрытые маршруты пропускаются.
+    """
+    seen = set()
+    for pattern in patterns:
+        route = prefix + str(pattern.pattern)
+        if isinstance(pattern, URLResolver):
+            for nested in routes(pattern.url_patterns, route):
+                if nested[0] not in seen:
+                    seen.add(nested[0])
+                    yield nested
+        elif '(?P<format>' not in route and route not in seen:
+            seen.add(route)
+            yield route, pattern.name, pattern.callback
+
+
+def route_methods(callback):
+    """HTTP-методы, которые обрабатывает представление."""
+    actions = getattr(callback, 'actions', None)
+    if actions:
+        return [method for method in METHODS if method in actions]
+    if hasattr(callback, 'http_method_names'):
+        return callback.http_method_names
+    view_class = getattr(callback, 'cls', None)
+    if view_class is None:
+        return ['get']
+    return [method for method in METHODS if hasattr(view_class, method)]
+
+
+@override_settings(MEDIA_ROOT=MEDIA_ROOT, IMAGE_PROCESSING_WORKERS=0,
+                   QUERY_BUDGETS_RAISE=True)
+class APITestCase(TestCase):
+    """Авторы с рецептами, читатель с токеном, избранным и подписками."""
+
+    @classmethod
+    def setUpTestData(cls):
+        cls.authors = [
+            CustomUser.objects.create_user(
+                username=f'author{i}', email=f'author{i}@example.com',
+                password='Author-12345',
+            )
+            for i in range(3)
+        ]
+        cls.reader = CustomUser.objects.create_user(
+            username='reader', email='reader@example.com',
+            password='Reader-12345',
+        )
+        cls.token = Token.objects.create(user=cls.reader)
+        cls.tags = [
+            Tag.objects.create(name=f'Тэг {i}', color='#000000', slug=f't{i}')
+            for i in range(3)
+        ]
+        cls.ingredients = [
+            Ingredient.objects.create(name=f'Ингредиент {i}',
+                                      measurement_unit='г')
+            for i in range(6)
+        ]
+        cls.recipes = []
+        for i in range(12):
+            recipe = Recipe.objects.create(
+                author=cls.authors[i % 3], name=f'Рецепт {i:02}',
+                text='Описание', cooking_time=5,
+                image=ContentFile(PNG, name='recipe.png'),
+            )
+            recipe.tags.set([cls.tags[i % 3], cls.tags[(i + 1) % 3]])
+            IngredientInRecipe.objects.bulk_create(
+                IngredientInRecipe(
+                    recipe=recipe, ingredient=cls.ingredients[(i + j) % 6],
+                    amount=j + 1,
+                )
+                for j in range(3)
+            )
+            cls.recipes.append(recipe)
+        for recipe in cls.recipes[:4]:
+            Favorite.objects.create(user=cls.reader, recipe=recipe)
+            ShoppingCart.objects.create(user=cls.reader, recipe=recipe)
+        shopping_list.refresh([cls.reader.id])
+        for author in cls.authors[:2]:
+            Follower.objects.create(
+                followed_user=cls.reader, following_user=author
+            )
+
+    @classmethod
+    def tearDownClass(cls):
+        super().tearDownClass()
+        shutil.rmtree(MEDIA_ROOT, ignore_errors=True)
+
+    def setUp(self):
+        self.clear_caches()
+        self.client = APIClient()
+        self.client.credentials(HTTP_AUTHORIZATION=f'Token {self.token.key}')
+
+    @staticmethod
+    def clear_caches():
+        for cache in caches.all():
+            cache.clear()
+
+    def recipe_data(self, **data):
+        return {
+            'name': 'Новый рецепт', 'text': 'Описание', 'cooking_time': 10,
+            'image': 'data:image/png;base64,' + base64.b64encode(PNG).decode(),
+            'tags': [self.tags[1].id, self.tags[0].id],
+            'ingredients': [
+                {'id': ingredient.id, 'amount': 2}
+                for ingredient in self.ingredients[:3]
+            ],
+            **data,
+        }
+
+
+class ReadQueriesTest(APITestCase):
+    """Число запросов на чтение не зависит от размера страницы."""
+
+    def test_recipe_list(self):
+        # Токен, количество, страница, тэги и ингредиенты страницы; на
+        # PostgreSQL перед подсчётом читается оценка числа строк.
+        queries = 6 if connection.vendor == 'postgresql' else 5
+        with self.assertNumQueries(queries):
+            response = self.client.get('/api/recipes/?limit=2')
+        self.assertEqual(len(response.data['results']), 2)
+        # Количество записей кэшируется, сравниваем с холодным кэшем.
+        self.clear_caches()
+        with self.assertNumQueries(queries):
+            response = self.client.get('/api/recipes/?limit=12')
+        self.assertEqual(len(response.data['results']), 12)
+
+    def test_recipe_detail(self):
+        with self.assertNumQueries(4):
+            response = self.client.get(f'/api/recipes/{self.recipes[0].id}/')
+        self.assertTrue(response.data['is_favorited'])
+        self.assertEqual(len(response.data['ingredients']), 3)
+
+    def test_subscriptions(self):
+        # Токен, количество, авторы и превью рецептов всех авторов страницы.
+        with self.assertNumQueries(4):
+            response = self.client.get(
+                '/api/users/subscriptions/?limit=6&recipes_limit=2'
+            )
+        self.assertEqual(len(response.data['results']), 2)
+        for author in response.data['results']:
+            self.assertEqual(len(author['recipes']), 2)
+            self.assertTrue(author['is_subscribed'])
+
+
+class QueryPlansTest(APITestCase):
+    """
+    Основные запросы api/views.py и api/filters.py используют индексы.
+    На PostgreSQL план строится при выключенных enable_seqscan и
+    enable_sort: Seq Scan или Sort в нём значит, что подходящего индекса
+    нет. На SQLite ищутся полный просмотр таблицы и сортировка во
+    временном B-дереве. Сортировка допускается, только если для базы
+    записана причина. На PostgreSQL тест запускается в CI
+    (.github/workflows/main.yml).
+    """
+
+    def hot_queries(self):
+        user = self.reader
+        request = SimpleNamespace(user=user)
+        recipe_ids = [recipe.id for recipe in self.recipes[:6]]
+
+        def filtered(**params):
+            data = MultiValueDict({
+                key: value if isinstance(value, list) else [value]
+                for key, value in params.items()
+            })
+            return RecipeFilter(
+                data, queryset=recipes_for_read(user), request=request
+            ).qs
+
+        rank = (
+            'релевантность ts_rank считается по найденным строкам, индекса '
+            'для неё нет; сортируются только совпадения, с LIMIT — top-N'
+        )
+        # Запрос, причины допустимой сортировки по базам.
+        return [
+            ('Список рецептов', recipes_for_read(user)[:6], {}),
+            ('Рецепты автора',
+             filtered(author=str(self.authors[0].pk))[:6], {}),
+            ('Рецепты по тэгам', filtered(tags=['t0', 't1'])[:6], {}),
+            ('Поиск рецептов', filtered(search='суп')[:6],
+             {'postgresql': rank, 'sqlite': rank}),
+            ('Ингредиенты рецептов страницы',
+             IngredientInRecipe.objects.select_related('ingredient').filter(
+                 recipe_id__in=recipe_ids
+             ).order_by('recipe_id', 'ingredient_id'), {}),
+            ('Тэги рецептов страницы',
+             Recipe.tags.through.objects.filter(recipe_id__in=recipe_ids),
+             {}),
+            ('Избранное', filtered(is_favorited='true')[:6], {}),
+            ('Корзина', filtered(is_in_shopping_cart='true')[:6], {}),
+            ('Подписки', following_users_for(user, 3)[:6], {
+                'sqlite': 'планировщик идёт от подписок пользователя по '
+                          'индексу и сортирует только его авторов',
+            }),
+            ('Список покупок', shopping_list_for(user), {
+                'sqlite': 'сортируются только позиции одного пользователя, '
+                          'найденные по индексу user_id',
+            }),
+        ]
+
+    @staticmethod
+    def plan_problems(plan, forbid_sort):
+        if connection.vendor == 'postgresql':
+            lines = [line.strip().lstrip('-> ') for line in plan.splitlines()]
+            problems = ['Seq Scan'] if 'Seq Scan' in plan else []
+            if forbid_sort and any(line.startswith('Sort') for line in lines):
+                problems.append('Sort')
+            return problems
+        problems = re.findall(r'\bSCAN \w+$', plan, re.MULTILINE)
+        if forbid_sort and 'USE TEMP B-TREE FOR ORDER BY' in plan:
+            problems.append('USE TEMP B-TREE FOR ORDER BY')
+        return problems
+
+    def test_hot_queries_use_indexes(self):
+        for title, queryset, sorts in self.hot_queries():
+            forbid_sort = connection.vendor not in sorts
+            with self.subTest(title), transaction.atomic():
+                if connection.vendor == 'postgresql':
+                    with connection.cursor() as cursor:
+                        cursor.execute('SET LOCAL enable_seqscan = off')
+                        cursor.execute('SET LOCAL enable_sort = off')
+                plan = queryset.explain()
+                self.assertEqual(self.plan_problems(plan, forbid_sort), [],
+                                 plan)
+
+
+class RecipeWriteTest(APITestCase):
+    """Запись рецепта: ответ совпадает с чтением, запросы не растут."""
+
+    def assertMatchesRead(self, response, exclude=()):
+        read = self.client.get(f'/api/recipes/{response.data["id"]}/')
+        for key in exclude:
+            self.assertIn(key, read.data)
+            del response.data[key], read.data[key]
+        self.assertEqual(response.data, read.data)
+
+    @contextmanager
+    def assertRepresentationQueries(self, limit):
+        """
+        Ответ на запись строится из сохранённого объекта не больше чем за
+        limit запросов.
+        """
+        counts = []
+        to_representation = RecipeSerializer.to_representation
+
+        def measured(serializer, instance):
+            with CaptureQueriesContext(connection) as queries:
+                data = to_representation(serializer, instance)
+            counts.append(len(queries))
+            return data
+
+        with patch.object(RecipeSerializer, 'to_representation', measured):
+            yield
+        self.assertEqual(len(counts), 1)
+        self.assertLessEqual(counts[0], limit)
+
+    def test_create(self):
+        # Вместе с обработкой изображения после фиксации транзакции.
+        with self.assertNumQueries(18), \
+                self.captureOnCommitCallbacks(execute=True), \
+                self.assertRepresentationQueries(1):
+            response = self.client.post(
+                '/api/recipes/', self.recipe_data(), format='json'
+            )
+        self.assertEqual(response.status_code, 201, response.data)
+        self.assertEqual(
+            response.data['author']['recipes_count'],
+            Recipe.objects.filter(author=self.reader).count(),
+        )
+        # Ответ отдаётся до обработки изображения.
+        self.assertMatchesRead(
+            response, exclude=('image', 'images', 'image_status')
+        )
+
+    def test_duplicate_tags(self):
+        tag_id = self.tags[0].id
+        response = self.client.post(
+            '/api/recipes/', self.recipe_data(tags=[tag_id, tag_id]),
+            format='json',
+        )
+        self.assertEqual(
+            [tag['id'] for tag in response.data['tags']], [tag_id]
+        )
+        self.assertMatchesRead(response)
+
+        response = self.client.patch(
+            f'/api/recipes/{response.data["id"]}/',
+            {'tags': [self.tags[2].id, tag_id, self.tags[2].id]},
+            format='json',
+        )
+        self.assertEqual(
+            [tag['id'] for tag in response.data['tags']],
+            [tag_id, self.tags[2].id],
+        )
+        self.assertMatchesRead(response)
+
+    def test_update(self):
+        recipe = self.recipes[0]
+        self.client.force_authenticate(recipe.author)
+        data = self.recipe_data(
+            tags=[self.tags[2].id],
+            ingredients=[{'id': self.ingredients[5].id, 'amount': 4}],
+        )
+        data.pop('image')
+        # Включая пересчёт списка покупок читателя, у которого рецепт
+        # в корзине.
+        with self.assertNumQueries(20), \
+                self.captureOnCommitCallbacks(execute=True), \
+                self.assertRepresentationQueries(1):
+            response = self.client.patch(
+                f'/api/recipes/{recipe.id}/', data, format='json'
+            )
+        self.assertEqual(response.status_code, 200, response.data)
+        self.assertMatchesRead(response)
+
+    def test_update_refreshes_shopping_lists_after_commit(self):
+        recipe = self.recipes[0]
+        ShoppingCart.objects.create(user=self.authors[1], recipe=recipe)
+        shopping_list.refresh([self.authors[1].id])
+        self.client.force_authenticate(recipe.author)
+        ingredient = self.ingredients[5]
+        with patch.object(shopping_list, 'REFRESH_BATCH_SIZE', 1), \
+                patch.object(shopping_list, 'refresh',
+                             wraps=shopping_list.refresh) as refresh:
+            with self.captureOnCommitCallbacks() as callbacks:
+                response = self.client.patch(
+                    f'/api/recipes/{recipe.id}/',
+                    {'ingredients': [{'id': ingredient.id, 'amount': 7}]},
+                    format='json',
+                )
+            self.assertEqual(response.status_code, 200, response.data)
+            # До фиксации транзакции списки покупок не трогаются.
+            refresh.assert_not_called()
+            for callback in callbacks:
+                callback()
+        # По транзакции на каждого пользователя при размере части 1.
+        self.assertEqual(refresh.call_count, 2)
+        self.assertEqual(shopping_list.find_mismatches(), {})
+
+
+class ResponseCacheTest(APITestCase):
+    """Ключ кэша анонимных ответов строится по очищенным фильтрам."""
+
+    def test_equivalent_filters_share_entry(self):
+        client = APIClient()
+        author = self.authors[0]
+        path = '/api/recipes/?limit=6&'
+        response = client.get(f'{path}author={author.id}&tags=t1&tags=t0')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        for query in (
+            f'author=0{author.id}&tags=t0&tags=t1',
+            f'tags=t0&author={author.id}&author={author.id}&tags=t1&tags=t0',
+        ):
+            with self.subTest(query=query):
+                self.assertEqual(client.get(path + query)['X-Cache'], 'HIT')
+
+        recipe = self.recipes[0]
+        self.client.force_authenticate(author)
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.patch(
+                f'/api/recipes/{recipe.id}/', {'name': 'Другое'},
+                format='json',
+            )
+        response = client.get(f'{path}author=0{author.id}&tags=t0&tags=t1')
+        self.assertEqual(response['X-Cache'], 'MISS')
+        self.assertIn(
+            'Другое', [item['name'] for item in response.data['results']]
+        )
+
+
+class ProjectionTest(APITestCase):
+    """Быстрый путь api/projections.py совпадает с RecipeSerializer."""
+
+    def test_same_json_as_serializer(self):
+        renderer = JSONRenderer()
+        for user in [AnonymousUser(), self.reader, *self.authors]:
+            with self.subTest(user=str(user)):
+                request = Request(APIRequestFactory().get('/api/recipes/'))
+                request.user = user
+                queryset = recipes_for_read(user)
+                expected = renderer.render(RecipeSerializer(
+                    queryset, many=True, context={'request': request}
+                ).data)
+                actual = renderer.render(
+                    represent_recipes(recipe_rows(queryset), request)
+                )
+                self.assertEqual(actual, expected)
+
+    def test_same_responses(self):
+        anonymous = APIClient()
+        paths = [
+            '/api/recipes/?limit=12',
+            '/api/recipes/?is_favorited=1&tags=t0',
+            f'/api/recipes/{self.recipes[0].id}/',
+        ]
+        for client, path in product((self.client, anonymous), paths):
+            with self.subTest(path=path, anonymous=client is anonymous):
+                self.clear_caches()
+                expected = client.get(path).content
+                self.clear_caches()
+                with self.settings(RECIPE_FAST_READ=True):
+                    self.assertEqual(client.get(path).content, expected)
+
+
+class MetricsTest(APITestCase):
+    """SQL-запросы потокового ответа учитываются после его передачи."""
+
+    @staticmethod
+    def sql_queries(view, method):
+        return metrics.SQL_QUERIES.labels(view, method)._sum.get()
+
+    def test_streaming_response_queries(self):
+        before = self.sql_queries('download-shoppingcart', 'GET')
+        response = self.client.get('/api/recipes/download_shopping_cart/')
+        self.assertEqual(self.sql_queries('download-shoppingcart', 'GET'),
+                         before)
+        content = b''.join(response.streaming_content).decode()
+        self.assertIn(self.ingredients[0].name, content)
+        # Токен и позиции списка покупок.
+        self.assertEqual(
+            self.sql_queries('download-shoppingcart', 'GET') - before, 2
+        )
+
+
+class ProfilingTest(APITestCase):
+    """Выборочные отчёты профилировщика не содержат параметров запросов."""
+
+    def profile(self, path, **headers):
+        with tempfile.TemporaryDirectory() as directory, self.settings(
+            PROFILING_ENABLED=True, PROFILING_DIR=directory,
+            PROFILING_SAMPLE_RATE=1,
+        ):
+            client = APIClient()
+            client.credentials(**headers)
+            client.get(path)
+            reports = list(Path(directory).glob('*.json'))
+            self.assertEqual(len(reports), 1)
+            return reports[0].read_text()
+
+    def test_sampled_report_has_no_params(self):
+        report = self.profile(
+            '/api/recipes/?name=secret',
+            HTTP_AUTHORIZATION=f'Token {self.token.key}',
+        )
+        self.assertIn('authtoken_token', report)
+        self.assertNotIn(self.token.key, report)
+        self.assertNotIn('secret', report)
+
+    def test_staff_report_has_params(self):
+        staff = CustomUser.objects.create_user(
+            username='staff', email='staff@example.com', is_staff=True,
+            password='Staff-12345',
+        )
+        token = Token.objects.create(user=staff)
+        report = self.profile(
+            '/api/recipes/?_profile=1', HTTP_AUTHORIZATION=f'Token {token}'
+        )
+        self.assertIn(token.key, report)
+        self.assertIn('_profile=1', report)
+
+
+class ImageProcessingTest(APITestCase):
+    """Картинка при переполненной очереди ждёт process_pending_images."""
+
+    @override_settings(IMAGE_PROCESSING_WORKERS=1, IMAGE_PROCESSING_QUEUE=0)
+    def test_full_queue_leaves_image_processing(self):
+        recipe = self.recipes[0]
+        Recipe.objects.filter(pk=recipe.pk).update(
+            image_status=Recipe.ImageStatus.PROCESSING
+        )
+        pool = ImageProcessingPool()
+        pool.get_executor()
+        self.assertTrue(pool._slots.acquire(blocking=False))
+        try:
+            with self.assertLogs('recipes.image_processing', 'WARNING'):
+                pool.submit(recipe.pk, recipe.image.name)
+        finally:
+            pool._slots.release()
+            pool._executor.shutdown()
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.ImageStatus.PROCESSING)
+
+        call_command('process_pending_images', stdout=StringIO())
+        recipe.refresh_from_db()
+        self.assertEqual(recipe.image_status, Recipe.ImageStatus.READY)
+
+
+def djoser_settings(**options):
+    return {**django_settings.DJOSER, **options}
+
+
+class QueryBudgetsTest(APITestCase):
+    """
+    У каждого маршрута api/urls.py есть бюджет SQL-запросов, и успешный
+    запрос укладывается в него вместе с работой после фиксации транзакции.
+    """
+
+    def setUp(self):
+        super().setUp()
+        self.checked = set()
+
+    def member(self, username, **fields):
+        return CustomUser.objects.create_user(
+            username=username, email=f'{username}@example.com',
+            password=PASSWORD, first_name='Имя', last_name='Фамилия',
+            **fields,
+        )
+
+    def check(self, method, path, data=None, user=None, status=200,
+              **settings):
+        self.client.credentials()
+        if user is not None:
+            token, _ = Token.objects.get_or_create(user=user)
+            self.client.credentials(HTTP_AUTHORIZATION=f'Token {token.key}')
+        match = resolve(path.partition('?')[0])
+        budget = resolve_budget(match.func, match.view_name, method)
+        with self.subTest(method=method, path=path):
+            with self.settings(**settings), \
+                    CaptureQueriesContext(connection) as queries, \
+                    self.captureOnCommitCallbacks(execute=True):
+                response = getattr(self.client, method)(
+                    path, data, format='json'
+                )
+                if response.streaming:
+                    b''.join(response.streaming_content)
+            self.assertEqual(
+                response.status_code, status, getattr(response, 'data', None)
+            )
+            self.assertIsNotNone(budget, match.view_name)
+            self.assertLessEqual(
+                len(queries), budget.limit(response_items(response))
+            )
+        self.checked.add((match.view_name, method))
+
+    def test_success_paths(self):
+        reader = self.reader
+        author = self.authors[0]
+        recipe, other_recipe = self.recipes[0], self.recipes[5]
+        self.check('get', '/api/', user=reader)
+        self.check('get', '/api/metrics')
+        self.check('post', '/api/auth/token/login/',
+                   {'email': reader.email, 'password': 'Reader-12345'},
+                   user=reader)
+        self.check('post', '/api/auth/token/logout/', user=reader,
+                   status=204)
+        self.check('get', '/api/tags/')
+        self.check('get', f'/api/tags/{self.tags[0].id}/')
+        self.check('get', '/api/ingredients/?name=Ингр')
+        self.check('get', f'/api/ingredients/{self.ingredients[0].id}/')
+
+        self.check('get', '/api/recipes/?limit=6', user=reader)
+        caches['default'].clear()
+        self.check('get', '/api/recipes/?limit=6&tags=t0&tags=t1',
+                   user=reader)
+        self.check('post', '/api/recipes/', self.recipe_data(), user=reader,
+                   status=201)
+        self.check('get', f'/api/recipes/{recipe.id}/', user=reader)
+        self.check('put', f'/api/recipes/{recipe.id}/', self.recipe_data(),
+                   user=author)
+        self.check('patch', f'/api/recipes/{recipe.id}/', {'name': 'Новое'},
+                   user=author)
+        self.check('delete', f'/api/recipes/{recipe.id}/', user=author,
+                   status=204)
+        for action in ('favorite', 'shopping_cart'):
+            path = f'/api/recipes/{other_recipe.id}/{action}/'
+            self.check('post', path, user=reader, status=201)
+            self.check('delete', path, user=reader, status=204)
+        self.check('get', '/api/recipes/download_shopping_cart/', user=reader)
+
+        self.check('get', '/api/users/subscriptions/?limit=6', user=reader)
+        path = f'/api/users/{self.authors[2].id}/subscribe/'
+        self.check('post', path, user=reader, status=201)
+        self.check('delete', path, user=reader, status=204)
+
+        self.check('get', '/api/users/?limit=6', user=reader)
+        self.check('post', '/api/users/', {
+            'email': 'new@example.com', 'username': 'new',
+            'first_name': 'Имя', 'last_name': 'Фамилия',
+            'password': PASSWORD,
+        }, user=reader, status=201)
+        user = self.member('detail')
+        self.check('get', f'/api/users/{author.id}/', user=reader)
+        self.check('get', '/api/users/me/', user=reader)
+        for path in (f'/api/users/{user.id}/', '/api/users/me/'):
+            self.check('put', path, {
+                'email': user.email, 'username': user.username,
+                'first_name': 'Другое', 'last_name': 'Имя',
+            }, user=user)
+            self.check('patch', path, {'first_name': 'Имя'}, user=user)
+        self.check('delete', f'/api/users/{user.id}/',
+                   {'current_password': PASSWORD}, user=user, status=204)
+        self.check('delete', '/api/users/me/',
+                   {'current_password': PASSWORD}, user=self.member('me'),
+                   status=204)
+
+        user = self.member('settings')
+        # DJOSER['USERNAME_FIELD'] не совпадает с полем модели, поэтому
+        # смена имени пользователя здесь и в reset_username_confirm
+        # доходит только до проверки данных.
+        self.check('post', '/api/users/set_username/',
+                   {'current_password': PASSWORD}, user=user, status=400)
+        self.check('post', '/api/users/set_password/', {
+            'current_password': PASSWORD, 'new_password': PASSWORD + '!',
+        }, user=user, status=204)
+        user = self.member('reset')
+        # Ссылки из писем в настройках не заданы, без них письма
+        # не отправить.
+        self.check('post', '/api/users/reset_password/',
+                   {'email': user.email}, user=reader, status=204,
+                   DJOSER=djoser_settings(
+                       PASSWORD_RESET_CONFIRM_URL='reset/{uid}/{token}',
+                   ))
+        self.check('post', '/api/users/reset_password_confirm/', {
+            'uid': encode_uid(user.pk),
+            'token': default_token_generator.make_token(user),
+            'new_password': PASSWORD,
+        }, user=reader, status=204)
+        self.check('post', '/api/users/reset_username/',
+                   {'email': user.email}, user=reader, status=204,
+                   DJOSER=djoser_settings(
+                       USERNAME_RESET_CONFIRM_URL='reset/{uid}/{token}',
+                   ))
+        self.check('post', '/api/users/reset_username_confirm/', {
+            'uid': encode_uid(user.pk),
+            'token': default_token_generator.make_token(user),
+        }, user=reader, status=400)
+
+        inactive = self.member('inactive', is_active=False)
+        self.check('post', '/api/users/resend_activation/',
+                   {'email': inactive.email}, user=reader, status=204,
+                   DJOSER=djoser_settings(
+                       SEND_ACTIVATION_EMAIL=True,
+                       ACTIVATION_URL='activate/{uid}/{token}',
+                   ))
+        self.check('post', '/api/users/activation/', {
+            'uid': encode_uid(inactive.pk),
+            'token': default_token_generator.make_token(inactive),
+        }, user=reader, status=204)
+
+        expected = {
+            (name, method)
+            for _, name, callback in routes(urls.urlpatterns)
+            for method in route_methods(callback)
+        }
+        self.assertEqual(expected - self.checked, set())
+
+    def test_exceeded_budget_raises(self):
+        self.client.force_authenticate(self.reader)
+        with patch.dict(RecipeViewSet.query_budget, retrieve=1), \
+                self.assertRaisesRegex(QueryBudgetExceeded, 'бюджете 1'):
+            self.client.get(f'/api/recipes/{self.recipes[0].id}/')
+
+    def test_browsable_api_skipped(self):
+        response = self.client.get('/api/tags/?format=api')
+        self.assertEqual(response.status_code, 200)
+
+    @override_settings(QUERY_BUDGETS_RAISE=False)
+    def test_exceeded_budget_logs_duplicates(self):
+        def render():
+            CustomUser.objects.count()
+            CustomUser.objects.count()
+            return b''
+
+        with patch('api.views.render_metrics', render), \
+                self.assertLogs('api.middleware', 'WARNING') as logs:
+            response = self.client.get('/api/metrics')
+        self.assertEqual(response.status_code, 200)
+        message, = logs.output
+        self.assertIn('2 SQL-запросов при бюджете 0. Повторы:', message)
+        self.assertIn('2 x SELECT COUNT(*)', message)
+
+
+class AsyncURLConf:
+    """Маршруты API с ASYNC_VIEWS=True."""
+
+    urlpatterns = [
+        re_path(r'^api/', include(urls.async_urlpatterns + urls.urlpatterns)),
+    ]
+
+
+@override_settings(ASYNC_VIEWS=True, ROOT_URLCONF=AsyncURLConf)
+class AsyncViewsTest(APITestCase):
+    """
+    Асинхронные представления под AsyncClient: ответы как у синхронных,
+    счётчики и список покупок. Бюджеты запросов проверяет middleware.
+    """
+
+    async def call(self, method, url, authorization=True):
+        # AsyncClient в Django 4.2 не передаёт заголовки из конструктора.
+        if authorization is True:
+            authorization = f'Token {self.token.key}'
+        headers = {'Authorization': authorization} if authorization else {}
+        return await getattr(AsyncClient(), method)(url, headers=headers)
+
+    async def counter(self, model, pk, field):
+        return await model.objects.values_list(field, flat=True).aget(pk=pk)
+
+    async def shopping_list(self):
+        return {
+            ingredient_id: amount
+            async for ingredient_id, amount in ShoppingListItem.objects.filter(
+                user=self.reader
+            ).values_list('ingredient_id', 'total_amount')
+        }
+
+    async def test_recipe_toggles(self):
+        recipe = self.recipes[5]
+        for action, field, add_to in (
+            ('favorite', 'favorites_count', 'избранное'),
+            ('shopping_cart', 'shopping_carts_count', 'корзину'),
+        ):
+            url = f'/api/recipes/{recipe.id}/{action}/'
+            with self.subTest(action=action):
+                response = await self.call('post', url)
+                self.assertEqual(response.status_code, 201)
+                self.assertEqual(
+                    response.json(), ShortRecipeSerializer(recipe).data
+                )
+                self.assertEqual(
+                    await self.counter(Recipe, recipe.id, field), 1
+                )
+
+                response = await self.call('post', url)
+                self.assertEqual(response.status_code, 400)
+                self.assertEqual(
+                    response.json(),
+                    {'error': f'Рецепт уже добавлен в {add_to}'},
+                )
+                self.assertEqual(
+                    await self.counter(Recipe, recipe.id, field), 1
+                )
+
+                response = await self.call('delete', url)
+                self.assertEqual(response.status_code, 204)
+                self.assertEqual(response.content, b'')
+                self.assertEqual(
+                    await self.counter(Recipe, recipe.id, field), 0
+                )
+
+                response = await self.call('delete', url)
+                self.assertEqual(response.status_code, 404)
+                response = await self.call(
+                    'post', f'/api/recipes/{recipe.id + 100}/{action}/'
+                )
+                self.assertEqual(response.status_code, 404)
+
+    async def test_shopping_cart_updates_shopping_list(self):
+        recipe = self.recipes[5]
+        url = f'/api/recipes/{recipe.id}/shopping_cart/'
+        before = await self.shopping_list()
+        added = {
+            ingredient_id: amount
+            async for ingredient_id, amount in recipe.ingredient_amount
+            .values_list('ingredient_id', 'amount')
+        }
+
+        response = await self.call('post', url)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual(await self.shopping_list(), {
+            ingredient_id: amount + added.get(ingredient_id, 0)
+            for ingredient_id, amount in before.items()
+        })
+        self.assertEqual(
+            await sync_to_async(shopping_list.find_mismatches)(), {}
+        )
+
+        response = await self.call('delete', url)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(await self.shopping_list(), before)
+
+    async def test_subscribe(self):
+        author = self.authors[2]
+        url = f'/api/users/{author.id}/subscribe/'
+        response = await self.call('post', url)
+        self.assertEqual(response.status_code, 201)
+        data = response.json()
+        self.assertEqual(
+            (data['id'], data['is_subscribed'], data['recipes_count']),
+            (author.id, True, 4),
+        )
+        self.assertEqual(
+            await self.counter(CustomUser, author.id, 'followers_count'), 1
+        )
+
+        response = await self.call('post', url)
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(),
+            {'error': 'Вы уже подписаны на данного пользователя'},
+        )
+        response = await self.call(
+            'post', f'/api/users/{self.reader.id}/subscribe/'
+        )
+        self.assertEqual(response.status_code, 400)
+        self.assertEqual(
+            response.json(), {'error': 'Нельзя подписаться на самого себя'}
+        )
+
+        response = await self.call('delete', url)
+        self.assertEqual(response.status_code, 204)
+        self.assertEqual(
+            await self.counter(CustomUser, author.id, 'followers_count'), 0
+        )
+        response = await self.call('delete', url)
+        self.assertEqual(response.status_code, 404)
+
+    async def test_errors_match_drf(self):
+        url = f'/api/recipes/{self.recipes[5].id}/favorite/'
+        response = await self.call('get', url)
+        self.assertEqual(response.status_code, 405)
+        self.assertEqual(
+            response.json(), {'detail': 'Method "GET" not allowed.'}
+        )
+
+        response = await self.call('post', url, authorization=None)
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+
+        response = await self.call('post', url, 'Token invalid')
+        self.assertEqual(response.status_code, 401)
+        self.assertEqual(response['WWW-Authenticate'], 'Token')
+        self.assertEqual(response.json(), {'detail': 'Invalid token.'})
+
+    async def test_recipe_detail(self):
+        recipe = self.recipes[0]
+        url = f'/api/recipes/{recipe.id}/'
+        with self.settings(ROOT_URLCONF='foodgram.urls'):
+            expected = await sync_to_async(self.client.get)(url)
+        response = await self.call('get', url)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.json(), expected.json())
+        self.assertTrue(response.json()['is_favorited'])
+
+        response = await self.call('get', url, authorization=None)
+        self.assertEqual(response.status_code, 200)
+        self.assertFalse(response.json()['is_favorited'])
+
+        response = await self.call('get', f'/api/recipes/{10 ** 6}/')
+        self.assertEqual(response.status_code, 404)
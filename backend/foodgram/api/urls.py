@@ -1,9 +1,12 @@
+from django.conf import settings
 from django.urls import include, path, re_path
 from rest_framework.routers import DefaultRouter
 
+from . import async_views
 from .views import (IngredientViewSet, RecipeViewSet, TagViewSet, UserViewSet,
                     add_delete_favorite, add_delete_shoppingcart,
-                    download_shopping_cart, subscribe, subscriptions)
+                    download_shopping_cart, metrics, subscribe,
+                    subscriptions)
 
 router = DefaultRouter()
 router.register('tags', TagViewSet, basename='tag')
@@ -12,6 +15,7 @@ router.register('ingredients', IngredientViewSet, basename='ingredient')
 router.register('recipes', RecipeViewSet, basename='recipe')
 
 urlpatterns = [
+    path('metrics', metrics, name='metrics'),
     path('users/subscriptions/', subscriptions, name='subscription_list'),
     path('users/<int:id>/subscribe/', subscribe, name='subscribe'),
     path('recipes/download_shopping_cart/', download_shopping_cart,
@@ -24,3 +28,21 @@ urlpatterns = [
          name='add-delete-shoppingcart'),
     re_path(r'^auth/', include('djoser.urls.authtoken')),
 ]
+
+# Асинхронные версии частых коротких запросов для запуска под ASGI;
+# с ASYNC_VIEWS стоят первыми и перекрывают синхронные маршруты с теми же
+# именами.
+async_urlpatterns = [
+    path('recipes/<int:pk>/', async_views.recipe_detail,
+         name='recipe-detail'),
+    path('users/<int:id>/subscribe/', async_views.subscribe,
+         name='subscribe'),
+    path('recipes/<int:id>/favorite/', async_views.add_delete_favorite,
+         name='add-delete-favorite'),
+    path('recipes/<int:id>/shopping_cart/',
+         async_views.add_delete_shoppingcart,
+         name='add-delete-shoppingcart'),
+]
+
+if settings.ASYNC_VIEWS:
+    urlpatterns = async_urlpatterns + urlpatterns
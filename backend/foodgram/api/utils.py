@@ -1,13 +1,29 @@
-from django.db import IntegrityError
+from django.db import IntegrityError, transaction
 from django.shortcuts import get_object_or_404
 from rest_framework import status
 from rest_framework.response import Response
 
-from recipes.models import Recipe
+from recipes import counters, shopping_list
+from recipes.models import Recipe, ShoppingCart
 
 from .serializers import ShortRecipeSerializer
 
 
+def update_shopping_list(user, recipe):
+    """Пересчитывает список покупок после изменения корзины."""
+    shopping_list.refresh(
+        [user.id],
+        recipe.ingredient_amount.values_list('ingredient_id', flat=True)
+    )
+
+
+def counter_field(instance):
+    return (
+        'shopping_carts_count' if instance is ShoppingCart
+        else 'favorites_count'
+    )
+
+
 def post_delete_logic(request, id, instance, add_to: str):
     """
     Логика для добавления и удаления рецепта из корзины или избранного.
@@ -16,10 +32,14 @@ def post_delete_logic(request, id, instance, add_to: str):
     recipe = get_object_or_404(Recipe, id=id)
     if request.method == 'POST':
         try:
-            instance.objects.create(
-                user=request.user,
-                recipe=recipe,
-            )
+            with transaction.atomic():
+                instance.objects.create(
+                    user=request.user,
+                    recipe=recipe,
+                )
+                counters.change(Recipe, recipe.id, counter_field(instance), 1)
+                if instance is ShoppingCart:
+                    update_shopping_list(request.user, recipe)
             serializer = ShortRecipeSerializer(
                 recipe
             )
@@ -36,5 +56,9 @@ def post_delete_logic(request, id, instance, add_to: str):
             user=request.user,
             recipe=recipe,
         )
-        instace_to_delete.delete()
+        with transaction.atomic():
+            instace_to_delete.delete()
+            counters.change(Recipe, recipe.id, counter_field(instance), -1)
+            if instance is ShoppingCart:
+                update_shopping_list(request.user, recipe)
         return Response(status=status.HTTP_204_NO_CONTENT)
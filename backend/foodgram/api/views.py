@@ -1,29 +1,56 @@
 import datetime
 
+from django.conf import settings
 from django.core.exceptions import ValidationError
-from django.db import IntegrityError
-from django.http import HttpResponse
+from django.db import IntegrityError, transaction
+from django.http import HttpResponse, StreamingHttpResponse
 from django.shortcuts import get_object_or_404
+from django.utils.http import urlencode
 from django_filters.rest_framework import DjangoFilterBackend
 from djoser.views import UserViewSet as Uvs
+from prometheus_client import CONTENT_TYPE_LATEST
 from rest_framework import permissions, status, viewsets
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import (api_view, permission_classes,
+                                       renderer_classes)
 from rest_framework.permissions import IsAuthenticated
 from rest_framework.response import Response
 
-from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
-                            ShoppingCart, Tag)
+from recipes import counters
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
 from users.models import CustomUser, Follower
 
 from .filters import IngredientFilter, RecipeFilter, TagFilter
-from .mixins import ListRetrieveMixin
-from .paginators import PageNumberLimitPagination
+from .budgets import QueryBudget, query_budget
+from .caching import (RECIPE_LIST_VERSION, author_recipes_version_name,
+                      model_version_name, recipe_version_name,
+                      tag_recipes_version_name)
+from .ingredient_index import ingredient_index
+from .metrics import render as render_metrics
+from .mixins import (AnonymousResponseCacheMixin, ListRetrieveMixin,
+                     ProjectionReadMixin, VersionedCacheMixin)
+from .paginators import (FollowingUsersPagination, PageNumberLimitPagination,
+                         PageNumberOrCursorPagination)
+from .projections import recipe_rows, represent_recipes
+from .queries import (annotate_user_flags, following_users_for,
+                      recipes_for_read, shopping_list_for)
+from .relations import get_subscription_resolver
+from .renderers import (ShoppingListCSVRenderer, ShoppingListJSONRenderer,
+                        ShoppingListTextRenderer)
 from .serializers import (FollowingUserSerializer, IngredientSerializer,
                           RecipeSerializer, RecipeWriteSerializer,
                           TagSerializer, UserSerializer)
 from .utils import post_delete_logic
 
 
+@query_budget(0)
+def metrics(request):
+    """Метрики в текстовом формате Prometheus."""
+    return HttpResponse(
+        render_metrics(), content_type=CONTENT_TYPE_LATEST
+    )
+
+
+@query_budget(QueryBudget(4, per_item=0))
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
 def subscriptions(request):
@@ -31,30 +58,28 @@ def subscriptions(request):
         recipes_limit = int(request.query_params.get('recipes_limit', 3))
     except ValueError:
         recipes_limit = 3
+    recipes_limit = max(recipes_limit, 0)
 
-    following_users_ids = request.user.following.values_list(
-        'following_user', flat=True
-    )
-    following_users = CustomUser.objects.filter(id__in=following_users_ids)
+    following_users = following_users_for(request.user, recipes_limit)
+    context = {
+        'request': request,
+        'recipes_limit': recipes_limit,
+        'is_subscribed': True,
+    }
 
-    paginator = PageNumberLimitPagination()
+    paginator = FollowingUsersPagination()
     page = paginator.paginate_queryset(following_users, request)
     if page is not None:
-        context = {
-            'request': request,
-            'recipes_limit': recipes_limit,
-        }
         serializer = FollowingUserSerializer(page, many=True, context=context)
         return paginator.get_paginated_response(serializer.data)
 
     serializer = FollowingUserSerializer(
-        following_users,
-        many=True,
-        context={'request': request, 'recipes_limit': recipes_limit}
+        following_users, many=True, context=context
     )
     return Response(serializer.data)
 
 
+@query_budget({'post': 7, 'delete': 7})
 @api_view(['POST', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def subscribe(request, id):
@@ -62,12 +87,19 @@ def subscribe(request, id):
 
     if request.method == 'POST':
         try:
-            Follower.objects.create(
-                followed_user=request.user,
-                following_user=following_user
-            )
+            with transaction.atomic():
+                Follower.objects.create(
+                    followed_user=request.user,
+                    following_user=following_user
+                )
+                counters.change(
+                    CustomUser, following_user.id, 'followers_count', 1
+                )
+            following_user.followers_count += 1
+            get_subscription_resolver(request).invalidate()
             serializer = FollowingUserSerializer(
-                following_user, context={'request': request}
+                following_user,
+                context={'request': request, 'is_subscribed': True}
             )
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         except ValidationError:
@@ -87,79 +119,170 @@ def subscribe(request, id):
             followed_user=request.user,
             following_user=following_user,
         )
-        follow_relation.delete()
+        with transaction.atomic():
+            follow_relation.delete()
+            counters.change(
+                CustomUser, following_user.id, 'followers_count', -1
+            )
+        get_subscription_resolver(request).invalidate()
         return Response(status=status.HTTP_204_NO_CONTENT)
 
 
+@query_budget({'post': 6, 'delete': 7})
 @api_view(['POST', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def add_delete_favorite(request, id):
     return post_delete_logic(request, id, Favorite, 'избранное')
 
 
+@query_budget({'post': 13, 'delete': 14})
 @api_view(['POST', 'DELETE'])
 @permission_classes([IsAuthenticated])
 def add_delete_shoppingcart(request, id):
     return post_delete_logic(request, id, ShoppingCart, 'корзину')
 
 
+@query_budget(2)
 @api_view(['GET'])
 @permission_classes([IsAuthenticated])
+@renderer_classes([ShoppingListTextRenderer, ShoppingListCSVRenderer,
+                   ShoppingListJSONRenderer])
 def download_shopping_cart(request):
-    shopping_cart_recipe_ids = request.user.shoppingcart_user.values_list(
-        'recipe_id', flat=True
-    )
-
-    ingredient_list = {}
-    ingredients = IngredientInRecipe.objects.filter(
-        recipe_id__in=shopping_cart_recipe_ids).values_list(
-        'amount', 'ingredient__measurement_unit', 'ingredient__name'
-    )
-
-    for amount, measurement_unit, name in ingredients:
-        if name in ingredient_list:
-            ingredient_list[name] = (
-                ingredient_list[name][0] + amount, measurement_unit
-            )
-        else:
-            ingredient_list[name] = (amount, measurement_unit)
-
-    shopping_list_content = []
-    for ingredient, (amount, unit) in ingredient_list.items():
-        shopping_list_content.append(f"{ingredient}: {amount} {unit}\n")
-
-    shopping_list_string = ''.join(shopping_list_content)
+    renderer = request.accepted_renderer
+    ingredients = shopping_list_for(request.user).iterator()
 
     today = datetime.date.today().strftime('%Y-%m-%d')
-    file_name = f"{request.user.username}_{today}_shopping_list.txt"
+    file_name = (
+        f"{request.user.username}_{today}_shopping_list.{renderer.format}"
+    )
 
-    response = HttpResponse(shopping_list_string, content_type='text/plain')
+    response = StreamingHttpResponse(
+        renderer.stream(ingredients),
+        content_type=f'{renderer.media_type}; charset={renderer.charset}'
+    )
     response['Content-Disposition'] = f'attachment; filename={file_name}'
 
     return response
 
 
-class TagViewSet(ListRetrieveMixin):
+class TagViewSet(VersionedCacheMixin, ListRetrieveMixin):
     queryset = Tag.objects.all()
     serializer_class = TagSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = TagFilter
+    query_budget = {'list': QueryBudget(1, per_item=0), 'retrieve': 1}
 
 
-class IngredientViewSet(ListRetrieveMixin):
+class IngredientViewSet(VersionedCacheMixin, ListRetrieveMixin):
     queryset = Ingredient.objects.all()
     serializer_class = IngredientSerializer
     filter_backends = (DjangoFilterBackend,)
     filterset_class = IngredientFilter
+    query_budget = {'list': QueryBudget(1, per_item=0), 'retrieve': 1}
 
+    def list(self, request, *args, **kwargs):
+        name = request.query_params.get('name')
+        if not name:
+            return super().list(request, *args, **kwargs)
+        try:
+            limit = int(request.query_params.get('limit'))
+        except (TypeError, ValueError):
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        if limit < 1:
+            limit = settings.INGREDIENT_SEARCH_LIMIT
+        return Response(ingredient_index.search(name, limit))
 
-class RecipeViewSet(viewsets.ModelViewSet):
-    queryset = Recipe.objects.all()
+
+class RecipeViewSet(AnonymousResponseCacheMixin, ProjectionReadMixin,
+                    viewsets.ModelViewSet):
     serializer_class = RecipeWriteSerializer
-    pagination_class = PageNumberLimitPagination
+    pagination_class = PageNumberOrCursorPagination
     filter_backends = (DjangoFilterBackend,)
     filterset_class = RecipeFilter
     permission_classes = (permissions.IsAuthenticatedOrReadOnly,)
+    query_budget = {
+        # Список: с фильтром по тэгам или оценкой числа строк PostgreSQL.
+        'list': QueryBudget(6, per_item=0),
+        'retrieve': 4,
+        # Запись вместе с обработкой картинки и пересчётом списков покупок
+        # после фиксации транзакции.
+        'create': 18,
+        'update': 24,
+        'partial_update': 24,
+        'destroy': 20,
+    }
+
+    def get_queryset(self):
+        if self.action in ['list', 'retrieve']:
+            return recipes_for_read(self.request.user)
+        return annotate_user_flags(
+            Recipe.objects.select_related('author'), self.request.user
+        )
+
+    def use_projection(self):
+        return settings.RECIPE_FAST_READ
+
+    def get_projection_rows(self, queryset):
+        return recipe_rows(queryset)
+
+    def represent_rows(self, rows):
+        return represent_recipes(rows, self.request)
+
+    def filter_values(self, request):
+        """
+        Значения фильтров после очистки формой RecipeFilter, чтобы
+        ?author=01, ?author=1 и ?author=1&author=1 давали один ключ кэша.
+        None, если параметры фильтров некорректны.
+        """
+        if not hasattr(self, '_filter_values'):
+            filterset = self.filterset_class(
+                request.query_params, queryset=Recipe.objects.none(),
+                request=request,
+            )
+            self._filter_values = None
+            if filterset.is_valid():
+                values = {
+                    name: [value]
+                    for name, value in filterset.form.cleaned_data.items()
+                    if value not in (None, '', [])
+                }
+                if 'author' in values:
+                    author = values['author'][0]
+                    if author == int(author):
+                        values['author'] = [int(author)]
+                if 'tags' in values:
+                    values['tags'] = sorted(set(values['tags'][0]))
+                self._filter_values = values
+        return self._filter_values
+
+    def get_cache_query(self, request):
+        values = self.filter_values(request)
+        if values is None:
+            return super().get_cache_query(request)
+        params = [
+            (name, value) for name, value in request.query_params.lists()
+            if name not in self.filterset_class.base_filters
+        ]
+        return urlencode(sorted(params + list(values.items())), doseq=True)
+
+    def get_cache_dependencies(self, request, *args, **kwargs):
+        names = [model_version_name(Tag)]
+        if self.action == 'retrieve':
+            pk = kwargs[self.lookup_field]
+            names.append(recipe_version_name(int(pk) if pk.isdigit() else pk))
+            return names
+        values = self.filter_values(request)
+        if values is None:
+            authors = request.query_params.getlist('author')
+            tags = request.query_params.getlist('tags')
+        else:
+            authors = values.get('author', [])
+            tags = values.get('tags', [])
+        names.extend(author_recipes_version_name(a) for a in authors)
+        names.extend(tag_recipes_version_name(slug) for slug in tags)
+        if not authors and not tags:
+            names.append(RECIPE_LIST_VERSION)
+        return names
 
     def get_serializer_class(self):
         if self.action in ['list', 'retrieve']:
@@ -173,10 +296,8 @@ class RecipeViewSet(viewsets.ModelViewSet):
         write_serializer.is_valid(raise_exception=True)
         self.perform_create(write_serializer)
 
-        recipe = self.get_queryset().get(pk=write_serializer.instance.pk)
-
         read_serializer = RecipeSerializer(
-            recipe, context={'request': request}
+            write_serializer.instance, context={'request': request}
         )
 
         headers = self.get_success_headers(read_serializer.data)
@@ -191,14 +312,14 @@ class RecipeViewSet(viewsets.ModelViewSet):
 
         write_serializer = RecipeWriteSerializer(instance,
                                                  data=request.data,
+                                                 partial=kwargs.get(
+                                                     'partial', False),
                                                  context={
                                                      'request': request})
         write_serializer.is_valid(raise_exception=True)
         self.perform_update(write_serializer)
 
-        recipe = self.get_queryset().get(pk=instance.pk)
-
-        read_serializer = RecipeSerializer(recipe,
+        read_serializer = RecipeSerializer(write_serializer.instance,
                                            context={'request': request})
 
         return Response(read_serializer.data, status=status.HTTP_200_OK)
@@ -210,3 +331,23 @@ class RecipeViewSet(viewsets.ModelViewSet):
 class UserViewSet(Uvs):
     serializer_class = UserSerializer
     pagination_class = PageNumberLimitPagination
+    query_budget = {
+        'list': QueryBudget(4, per_item=0),
+        'create': 6,
+        'retrieve': 3,
+        'update': 6,
+        'partial_update': 6,
+        'destroy': 14,
+        'me': {'get': 2, 'put': 5, 'patch': 5, 'delete': 13},
+        'set_password': 2,
+        # Успешные пути set_username и reset_username_confirm недостижимы
+        # (см. QueryBudgetsTest), бюджеты как у set_password и
+        # reset_password_confirm.
+        'set_username': 2,
+        'activation': 3,
+        'resend_activation': 2,
+        'reset_password': 2,
+        'reset_password_confirm': 3,
+        'reset_username': 2,
+        'reset_username_confirm': 3,
+    }
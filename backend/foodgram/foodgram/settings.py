@@ -35,6 +35,8 @@ INSTALLED_APPS = [
 ]
 
 MIDDLEWARE = [
+    'api.middleware.MetricsMiddleware',
+    'api.middleware.QueryBudgetMiddleware',
     'django.middleware.security.SecurityMiddleware',
     'django.contrib.sessions.middleware.SessionMiddleware',
     'django.middleware.common.CommonMiddleware',
@@ -42,6 +44,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'api.middleware.ProfilingMiddleware',
 ]
 
 ROOT_URLCONF = 'foodgram.urls'
@@ -83,6 +86,24 @@ else:
         }
     }
 
+CACHES = {
+    'default': {
+        'BACKEND': os.getenv(
+            'CACHE_BACKEND', 'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv('CACHE_LOCATION', 'foodgram'),
+    },
+    'responses': {
+        'BACKEND': os.getenv(
+            'RESPONSE_CACHE_BACKEND',
+            'django.core.cache.backends.locmem.LocMemCache'
+        ),
+        'LOCATION': os.getenv(
+            'RESPONSE_CACHE_LOCATION', 'foodgram-responses'
+        ),
+    },
+}
+
 AUTH_PASSWORD_VALIDATORS = [
     {
         'NAME': 'django.contrib.auth.password_validation.UserAttributeSimilarityValidator',
@@ -169,3 +190,50 @@ CSRF_TRUSTED_ORIGINS = [
 
 INT_MIN_VALUE = 1
 INT_MAX_VALUE = 32000
+
+INGREDIENT_SEARCH_LIMIT = 20
+
+IMAGE_MAX_UPLOAD_SIZE = 10 * 1024 * 1024
+IMAGE_MAX_PIXELS = 40_000_000
+IMAGE_QUALITY = 85
+IMAGE_VARIANTS = {
+    'card': (480, 480),
+    'detail': (1200, 1200),
+}
+IMAGE_PROCESSING_WORKERS = int(os.getenv('IMAGE_PROCESSING_WORKERS', 2))
+IMAGE_PROCESSING_QUEUE = 32
+IMAGE_PROCESSING_RETRIES = 2
+IMAGE_PROCESSING_RETRY_DELAY = 1
+
+REFERENCE_MAX_AGE = 60
+REFERENCE_CACHE_TIMEOUT = 60 * 60 * 24
+
+RESPONSE_CACHE_TIMEOUT = 60
+
+RECIPE_FAST_READ = os.getenv('RECIPE_FAST_READ', default=False) == 'True'
+
+METRICS_ENABLED = os.getenv('METRICS_ENABLED', default='True') == 'True'
+
+# Асинхронные представления избранного, корзины и подписок;
+# включаются для процесса под ASGI-сервером (uvicorn).
+ASYNC_VIEWS = os.getenv('ASYNC_VIEWS', default=False) == 'True'
+
+QUERY_BUDGETS_ENABLED = os.getenv(
+    'QUERY_BUDGETS_ENABLED', default='True'
+) == 'True'
+# Превышение бюджета — исключение в отладке, иначе предупреждение. Тесты
+# api/tests.py включают исключения сами.
+QUERY_BUDGETS_RAISE = DEBUG
+# Бюджеты сторонних представлений по имени URL.
+QUERY_BUDGETS = {
+    'api-root': 1,
+    'login': 4,
+    'logout': 2,
+}
+
+PROFILING_ENABLED = os.getenv('PROFILING_ENABLED', default=False) == 'True'
+PROFILING_DIR = os.getenv('PROFILING_DIR', default=BASE_DIR / 'profiles')
+PROFILING_SAMPLE_RATE = int(os.getenv('PROFILING_SAMPLE_RATE', 0))
+
+PAGINATION_COUNT_TIMEOUT = 60
+PAGINATION_COUNT_ESTIMATE_THRESHOLD = 100_000
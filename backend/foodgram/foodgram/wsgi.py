@@ -14,3 +14,10 @@ from django.core.wsgi import get_wsgi_application
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'foodgram.settings')
 
 application = get_wsgi_application()
+
+from django.db import connections  # noqa: E402
+
+from api.ingredient_index import ingredient_index  # noqa: E402
+
+ingredient_index.warm_up()
+connections.close_all()
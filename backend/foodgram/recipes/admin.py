@@ -2,6 +2,7 @@ from django.contrib import admin
 
 from .models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
                      ShoppingCart, Tag)
+from .search import search_recipes
 
 
 @admin.register(Ingredient)
@@ -22,13 +23,16 @@ class IngredientInRecipeInline(admin.StackedInline):
 @admin.register(Recipe)
 class RecipeAdmin(admin.ModelAdmin):
     inlines = (IngredientInRecipeInline,)
-    list_display = ('author', 'name',)
+    list_display = ('author', 'name', 'favorites_count',)
     list_filter = ('author', 'name', 'tags')
     search_fields = ('author', 'name', 'tags')
     readonly_fields = ('count_favorites', )
 
+    def get_search_results(self, request, queryset, search_term):
+        return search_recipes(queryset, search_term), False
+
     def count_favorites(self, obj):
-        return Favorite.objects.filter(recipe=obj).count()
+        return obj.favorites_count
     count_favorites.short_description = 'Количество раз добавлен в избранное'
 
 
@@ -0,0 +1,62 @@
+from django.db.models import Count, F, OuterRef, Subquery
+from django.db.models.functions import Coalesce, Greatest
+
+from users.models import CustomUser, Follower
+
+from .models import Favorite, Recipe, ShoppingCart
+
+# Денормализованные счётчики: (модель, поле счётчика, модель связей,
+# поле связи, указывающее на строку со счётчиком).
+COUNTERS = (
+    (Recipe, 'favorites_count', Favorite, 'recipe'),
+    (Recipe, 'shopping_carts_count', ShoppingCart, 'recipe'),
+    (CustomUser, 'recipes_count', Recipe, 'author'),
+    (CustomUser, 'followers_count', Follower, 'following_user'),
+)
+
+
+def change(model, pk, field, delta):
+    """
+    Атомарно изменяет счётчик на delta одним UPDATE с F(). Счётчик,
+    разошедшийся с данными, не уходит ниже нуля до запуска reconcile.
+    """
+    value = F(field) + delta
+    if delta < 0:
+        value = Greatest(value, 0)
+    model.objects.filter(pk=pk).update(**{field: value})
+
+
+def actual_count(related_model, related_field):
+    return Coalesce(
+        Subquery(
+            related_model.objects.filter(
+                **{related_field: OuterRef('pk')}
+            ).order_by().values(related_field).annotate(
+                total=Count('pk')
+            ).values('total')
+        ),
+        0,
+    )
+
+
+def reconcile(batch_size=1000, dry_run=False):
+    """
+    Находит строки, у которых счётчик расходится с фактическим количеством
+    связей, и пересчитывает их пакетами. Возвращает словарь
+    {(модель, поле): количество исправленных строк}.
+    """
+    fixed = {}
+    for model, field, related_model, related_field in COUNTERS:
+        actual = actual_count(related_model, related_field)
+        ids = list(
+            model.objects.annotate(actual=actual).exclude(
+                **{field: F('actual')}
+            ).values_list('pk', flat=True)
+        )
+        if not dry_run:
+            for start in range(0, len(ids), batch_size):
+                model.objects.filter(
+                    pk__in=ids[start:start + batch_size]
+                ).update(**{field: actual})
+        fixed[(model._meta.label, field)] = len(ids)
+    return fixed
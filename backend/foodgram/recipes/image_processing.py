@@ -0,0 +1,124 @@
+import logging
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.core.files.storage import default_storage
+from django.db import close_old_connections, transaction
+
+from api.caching import bump_recipe_versions
+
+from .images import ingest_image
+from .models import Recipe
+
+logger = logging.getLogger(__name__)
+
+
+def process_recipe_image(recipe_id, upload_name):
+    """
+    Обрабатывает исходную картинку рецепта и подменяет её итоговой, если
+    за это время рецепту не загрузили другую. При ошибке повторяет попытку,
+    после IMAGE_PROCESSING_RETRIES неудач помечает картинку как failed.
+    """
+    attempts = settings.IMAGE_PROCESSING_RETRIES + 1
+    for attempt in range(1, attempts + 1):
+        try:
+            with default_storage.open(upload_name) as file:
+                image_name, variants = ingest_image(file)
+            with transaction.atomic():
+                updated = Recipe.objects.filter(
+                    pk=recipe_id, image=upload_name
+                ).update(
+                    image=image_name,
+                    image_variants=variants,
+                    image_status=Recipe.ImageStatus.READY,
+                )
+                if updated:
+                    invalidate_responses(recipe_id)
+                if updated and not Recipe.objects.filter(
+                    image=upload_name
+                ).exists():
+                    transaction.on_commit(
+                        lambda: default_storage.delete(upload_name)
+                    )
+            return True
+        except Exception:
+            logger.warning(
+                'Не удалось обработать картинку рецепта %s (попытка %s/%s)',
+                recipe_id, attempt, attempts, exc_info=True
+            )
+            if attempt < attempts:
+                time.sleep(settings.IMAGE_PROCESSING_RETRY_DELAY * attempt)
+    with transaction.atomic():
+        if Recipe.objects.filter(pk=recipe_id, image=upload_name).update(
+            image_status=Recipe.ImageStatus.FAILED
+        ):
+            invalidate_responses(recipe_id)
+    return False
+
+
+def invalidate_responses(recipe_id):
+    recipe = Recipe.objects.only('author_id').get(pk=recipe_id)
+    bump_recipe_versions(
+        recipe_id, recipe.author_id,
+        recipe.tags.values_list('slug', flat=True)
+    )
+
+
+class ImageProcessingPool:
+    """
+    Пул потоков для обработки картинок вне запроса. Число потоков
+    ограничено IMAGE_PROCESSING_WORKERS, очередь — IMAGE_PROCESSING_QUEUE.
+    При нулевом числе потоков картинка обрабатывается в текущем потоке.
+    При переполненной очереди картинка остаётся в статусе processing до
+    команды process_pending_images, чтобы не задерживать запрос под
+    нагрузкой.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._executor = None
+        self._slots = None
+
+    def get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(
+                    max_workers=settings.IMAGE_PROCESSING_WORKERS,
+                    thread_name_prefix='recipe-images',
+                )
+                self._slots = threading.BoundedSemaphore(
+                    settings.IMAGE_PROCESSING_WORKERS
+                    + settings.IMAGE_PROCESSING_QUEUE
+                )
+            return self._executor
+
+    def submit(self, recipe_id, upload_name):
+        if settings.IMAGE_PROCESSING_WORKERS < 1:
+            return process_recipe_image(recipe_id, upload_name)
+        executor = self.get_executor()
+        if not self._slots.acquire(blocking=False):
+            logger.warning(
+                'Очередь обработки картинок заполнена, картинка рецепта %s '
+                'ждёт process_pending_images', recipe_id
+            )
+            return
+        executor.submit(self.run, recipe_id, upload_name)
+
+    def run(self, recipe_id, upload_name):
+        try:
+            process_recipe_image(recipe_id, upload_name)
+        finally:
+            self._slots.release()
+            close_old_connections()
+
+
+image_processing_pool = ImageProcessingPool()
+
+
+def schedule_image_processing(recipe_id, upload_name):
+    """Ставит обработку картинки в очередь после фиксации транзакции."""
+    transaction.on_commit(
+        lambda: image_processing_pool.submit(recipe_id, upload_name)
+    )
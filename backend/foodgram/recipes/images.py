@@ -0,0 +1,110 @@
+import hashlib
+import io
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from PIL import Image, ImageOps
+
+Image.MAX_IMAGE_PIXELS = settings.IMAGE_MAX_PIXELS
+
+UPLOAD_TO = 'recipes/images/'
+RAW_UPLOAD_TO = 'recipes/uploads/'
+WEBP_SUFFIX = '_webp'
+
+
+def content_name(digest, ext, variant='', upload_to=UPLOAD_TO):
+    """Путь файла по хешу содержимого: одинаковые загрузки совпадают."""
+    suffix = f'_{variant}' if variant else ''
+    return f'{upload_to}{digest[:2]}/{digest}{suffix}.{ext}'
+
+
+def file_digest(file):
+    sha256 = hashlib.sha256()
+    file.seek(0)
+    for chunk in iter(lambda: file.read(64 * 1024), b''):
+        sha256.update(chunk)
+    file.seek(0)
+    return sha256.hexdigest()
+
+
+def has_alpha(image):
+    return image.mode in ('RGBA', 'LA') or (
+        image.mode == 'P' and 'transparency' in image.info
+    )
+
+
+def encode(image, image_format):
+    buffer = io.BytesIO()
+    if image_format == 'JPEG':
+        image.save(
+            buffer, 'JPEG', quality=settings.IMAGE_QUALITY,
+            optimize=True, progressive=True,
+        )
+    elif image_format == 'WEBP':
+        image.save(buffer, 'WEBP', quality=settings.IMAGE_QUALITY, method=4)
+    else:
+        image.save(buffer, image_format, optimize=True)
+    return buffer.getvalue()
+
+
+def save_once(name, render):
+    if not default_storage.exists(name):
+        default_storage.save(name, ContentFile(render()))
+    return name
+
+
+def variant_names(digest, ext):
+    names = {}
+    for variant in settings.IMAGE_VARIANTS:
+        names[variant] = content_name(digest, ext, variant)
+        names[variant + WEBP_SUFFIX] = content_name(digest, 'webp', variant)
+    return names
+
+
+def store_upload(file):
+    """
+    Сохраняет загруженный файл как есть, без обработки, и возвращает его
+    имя в хранилище.
+    """
+    image = getattr(file, 'image', None)
+    if image is not None and image.format:
+        ext = image.format.lower()
+    else:
+        ext = file.name.rsplit('.', 1)[-1].lower()
+    name = content_name(file_digest(file), ext, upload_to=RAW_UPLOAD_TO)
+    if default_storage.exists(name):
+        return name
+    return default_storage.save(name, file)
+
+
+def ingest_image(file):
+    """
+    Перекодирует загруженную картинку, сохраняет оригинал и уменьшенные
+    варианты (включая WebP) по хешу содержимого. Возвращает имя оригинала
+    и словарь имён вариантов. Повторная загрузка того же файла ничего
+    не пересохраняет.
+    """
+    digest = file_digest(file)
+    with Image.open(file) as source:
+        ext = 'png' if has_alpha(source) else 'jpg'
+        original_name = content_name(digest, ext)
+        variants = variant_names(digest, ext)
+        if default_storage.exists(original_name) and all(
+            default_storage.exists(name) for name in variants.values()
+        ):
+            return original_name, variants
+
+        image = ImageOps.exif_transpose(source)
+        image = image.convert('RGBA' if ext == 'png' else 'RGB')
+
+    image_format = 'PNG' if ext == 'png' else 'JPEG'
+    save_once(original_name, lambda: encode(image, image_format))
+    for variant, size in settings.IMAGE_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail(size, Image.LANCZOS)
+        save_once(variants[variant], lambda: encode(resized, image_format))
+        save_once(
+            variants[variant + WEBP_SUFFIX], lambda: encode(resized, 'WEBP')
+        )
+    return original_name, variants
@@ -0,0 +1,106 @@
+import random
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api.queries import filter_by_tags
+from recipes.models import Recipe, Tag
+from users.models import CustomUser
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = (
+        'Сравнивает фильтрацию рецептов по нескольким тэгам через JOIN с '
+        'DISTINCT и через подзапрос EXISTS. Тестовые данные создаются в '
+        'транзакции, которая откатывается после замеров.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--recipes', type=int, default=100_000)
+        parser.add_argument('--tags', type=int, default=8)
+        parser.add_argument('--tags-per-recipe', type=int, default=3)
+        parser.add_argument('--page-size', type=int, default=6)
+        parser.add_argument('--repeat', type=int, default=5)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        try:
+            with transaction.atomic():
+                tag_ids = self.seed(options)
+                self.measure(tag_ids, options)
+                raise Rollback
+        except Rollback:
+            pass
+
+    def seed(self, options):
+        rnd = random.Random(options['seed'])
+        started = time.monotonic()
+        author = CustomUser.objects.create(
+            username='benchmark_tag_filter',
+            email='benchmark_tag_filter@example.com',
+        )
+        tags = Tag.objects.bulk_create(
+            Tag(name=f'bench-{i}', color='#000000', slug=f'bench-{i}')
+            for i in range(options['tags'])
+        )
+        Through = Recipe.tags.through
+        batch_size = 5000
+        for start in range(0, options['recipes'], batch_size):
+            recipes = Recipe.objects.bulk_create(
+                Recipe(
+                    author=author, name=f'bench {i:07}', text='bench',
+                    cooking_time=1, image='bench.png',
+                )
+                for i in range(
+                    start, min(start + batch_size, options['recipes'])
+                )
+            )
+            Through.objects.bulk_create(
+                Through(recipe_id=recipe.id, tag_id=tag.id)
+                for recipe in recipes
+                for tag in rnd.sample(tags, options['tags_per_recipe'])
+            )
+        self.stdout.write(
+            f'Создано рецептов: {options["recipes"]} '
+            f'за {time.monotonic() - started:.1f} с'
+        )
+        return [tag.id for tag in tags[:2]]
+
+    def measure(self, tag_ids, options):
+        page_size = options['page_size']
+        variants = {
+            'join + distinct': lambda: Recipe.objects.filter(
+                tags__id__in=tag_ids
+            ).distinct(),
+            'exists': lambda: filter_by_tags(Recipe.objects.all(), tag_ids),
+        }
+        for title, build in variants.items():
+            timings = {'count': [], 'first page': [], 'deep page': []}
+            for _ in range(options['repeat']):
+                queryset = build()
+                timings['count'].append(self.timed(queryset.count))
+                timings['first page'].append(
+                    self.timed(lambda: list(queryset[:page_size]))
+                )
+                offset = queryset.count() // 2
+                timings['deep page'].append(self.timed(
+                    lambda: list(queryset[offset:offset + page_size])
+                ))
+            self.stdout.write(title)
+            for operation, values in timings.items():
+                self.stdout.write(
+                    f'  {operation}: медиана '
+                    f'{statistics.median(values) * 1000:.1f} мс'
+                )
+
+    @staticmethod
+    def timed(function):
+        started = time.perf_counter()
+        function()
+        return time.perf_counter() - started
@@ -0,0 +1,202 @@
+import csv
+import io
+import json
+import time
+from pathlib import Path
+
+from django.conf import settings
+from django.core.cache import caches
+from django.core.cache.backends.locmem import LocMemCache
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+
+from api.caching import bump_version, model_version_name
+from recipes.models import Ingredient
+
+DEFAULT_PATH = settings.BASE_DIR.parent.parent / 'data' / 'ingredients.csv'
+NAME_MAX_LENGTH = Ingredient._meta.get_field('name').max_length
+UNIT_MAX_LENGTH = Ingredient._meta.get_field('measurement_unit').max_length
+
+
+def read_csv(file):
+    for row in csv.reader(file):
+        if len(row) >= 2:
+            yield row[0], row[1]
+
+
+def read_json(file, chunk_size=64 * 1024):
+    """Потоково разбирает JSON-массив объектов, не загружая файл целиком."""
+    decoder = json.JSONDecoder()
+    buffer = ''
+    position = 0
+    started = False
+    while True:
+        chunk = file.read(chunk_size)
+        buffer = buffer[position:] + chunk
+        position = 0
+        while True:
+            while position < len(buffer) and buffer[position] in ' \t\r\n,':
+                position += 1
+            if not started and buffer[position:position + 1] == '[':
+                started = True
+                position += 1
+                continue
+            if buffer[position:position + 1] == ']':
+                return
+            try:
+                item, position = decoder.raw_decode(buffer, position)
+            except json.JSONDecodeError:
+                if not chunk:
+                    raise CommandError('Некорректный JSON-файл')
+                break
+            yield item['name'], item['measurement_unit']
+        if not chunk:
+            return
+
+
+class RowStream(io.TextIOBase):
+    """Файлоподобная обёртка над строками для COPY FROM STDIN."""
+
+    def __init__(self, rows):
+        self._rows = rows
+        self._buffer = io.StringIO()
+        self._writer = csv.writer(self._buffer)
+        self._pending = ''
+
+    def readable(self):
+        return True
+
+    def read(self, size=-1):
+        while size < 0 or len(self._pending) < size:
+            row = next(self._rows, None)
+            if row is None:
+                break
+            self._writer.writerow(row)
+            self._pending += self._buffer.getvalue()
+            self._buffer.seek(0)
+            self._buffer.truncate()
+        if size < 0:
+            size = len(self._pending)
+        data, self._pending = self._pending[:size], self._pending[size:]
+        return data
+
+
+class Command(BaseCommand):
+    help = (
+        'Загружает ингредиенты из CSV или JSON файла. Повторный запуск '
+        'безопасен: существующие пары (название, единица) пропускаются.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            'path', nargs='?', default=str(DEFAULT_PATH),
+            help='Путь к файлу ingredients.csv или ingredients.json.',
+        )
+        parser.add_argument(
+            '--format', choices=('csv', 'json'),
+            help='Формат файла. По умолчанию определяется по расширению.',
+        )
+        parser.add_argument(
+            '--batch-size', type=int, default=1000,
+            help='Размер пакета bulk_create.',
+        )
+        parser.add_argument(
+            '--no-copy', action='store_true',
+            help='Не использовать COPY FROM STDIN на PostgreSQL.',
+        )
+
+    def handle(self, *args, **options):
+        path = Path(options['path'])
+        if not path.exists():
+            raise CommandError(f'Файл {path} не найден')
+        file_format = options['format'] or path.suffix.lstrip('.').lower()
+        if file_format not in ('csv', 'json'):
+            raise CommandError('Поддерживаются только форматы csv и json')
+        self.skipped = 0
+
+        started = time.monotonic()
+        use_copy = (
+            connection.vendor == 'postgresql' and not options['no_copy']
+        )
+        with path.open(encoding='utf-8') as file:
+            reader = read_csv if file_format == 'csv' else read_json
+            rows = self.clean(reader(file))
+            with transaction.atomic():
+                if use_copy:
+                    read, created = self.copy(rows)
+                else:
+                    read, created = self.bulk_insert(
+                        rows, options['batch_size']
+                    )
+        elapsed = time.monotonic() - started
+
+        if created:
+            bump_version(model_version_name(Ingredient))
+            if isinstance(caches['default'], LocMemCache):
+                self.stderr.write(
+                    'Кэш хранится в памяти процесса: запущенные воркеры '
+                    'увидят новые ингредиенты только после перезапуска. '
+                    'Настройте общий CACHE_BACKEND, например Redis.'
+                )
+        self.stdout.write(self.style.SUCCESS(
+            f'Прочитано строк: {read}, добавлено: {created}, '
+            f'пропущено некорректных: {self.skipped}. '
+            f'{elapsed:.2f} с, {read / elapsed if elapsed else read:.0f} '
+            f'строк/с.'
+        ))
+
+    def clean(self, rows):
+        for name, measurement_unit in rows:
+            name, measurement_unit = name.strip(), measurement_unit.strip()
+            if (
+                not name or not measurement_unit
+                or len(name) > NAME_MAX_LENGTH
+                or len(measurement_unit) > UNIT_MAX_LENGTH
+            ):
+                self.skipped += 1
+                continue
+            yield name, measurement_unit
+
+    def bulk_insert(self, rows, batch_size):
+        before = Ingredient.objects.count()
+        read = 0
+        batch = []
+        for name, measurement_unit in rows:
+            read += 1
+            batch.append(
+                Ingredient(name=name, measurement_unit=measurement_unit)
+            )
+            if len(batch) >= batch_size:
+                Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+                batch = []
+        Ingredient.objects.bulk_create(batch, ignore_conflicts=True)
+        return read, Ingredient.objects.count() - before
+
+    def copy(self, rows):
+        table = Ingredient._meta.db_table
+        counter = {'read': 0}
+
+        def counted(rows):
+            for row in rows:
+                counter['read'] += 1
+                yield row
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                'CREATE TEMPORARY TABLE ingredient_import '
+                f'(name varchar({NAME_MAX_LENGTH}), '
+                f'measurement_unit varchar({UNIT_MAX_LENGTH})) '
+                'ON COMMIT DROP'
+            )
+            cursor.cursor.copy_expert(
+                'COPY ingredient_import (name, measurement_unit) '
+                'FROM STDIN WITH (FORMAT csv)',
+                RowStream(counted(rows)),
+            )
+            cursor.execute(
+                f'INSERT INTO {table} (name, measurement_unit) '
+                'SELECT DISTINCT name, measurement_unit '
+                'FROM ingredient_import '
+                'ON CONFLICT (name, measurement_unit) DO NOTHING'
+            )
+            return counter['read'], cursor.rowcount
@@ -0,0 +1,36 @@
+from django.core.management.base import BaseCommand
+
+from recipes.image_processing import process_recipe_image
+from recipes.models import Recipe
+
+
+class Command(BaseCommand):
+    help = (
+        'Обрабатывает картинки рецептов, оставшиеся в статусе processing '
+        '(например, после перезапуска воркеров).'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--failed',
+            action='store_true',
+            help='Также повторить обработку картинок со статусом failed.',
+        )
+
+    def handle(self, *args, **options):
+        statuses = [Recipe.ImageStatus.PROCESSING]
+        if options['failed']:
+            statuses.append(Recipe.ImageStatus.FAILED)
+        pending = Recipe.objects.filter(
+            image_status__in=statuses
+        ).values_list('id', 'image')
+
+        processed = failed = 0
+        for recipe_id, upload_name in pending.iterator():
+            if process_recipe_image(recipe_id, upload_name):
+                processed += 1
+            else:
+                failed += 1
+        self.stdout.write(
+            f'Обработано картинок: {processed}, с ошибкой: {failed}.'
+        )
@@ -0,0 +1,18 @@
+from django.core.management.base import BaseCommand
+from django.db import DEFAULT_DB_ALIAS, connections
+
+from recipes import search
+
+
+class Command(BaseCommand):
+    help = (
+        'Перестраивает полнотекстовый индекс рецептов: search_vector на '
+        'PostgreSQL или таблицу FTS5 вместе с триггерами на SQLite.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--database', default=DEFAULT_DB_ALIAS)
+
+    def handle(self, *args, **options):
+        search.rebuild(connections[options['database']])
+        self.stdout.write(self.style.SUCCESS('Поисковый индекс перестроен.'))
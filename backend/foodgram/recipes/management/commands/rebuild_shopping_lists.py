@@ -0,0 +1,40 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from recipes import shopping_list
+
+
+class Command(BaseCommand):
+    help = (
+        'Перестраивает таблицу списков покупок по корзинам пользователей '
+        'и сверяет её с расчётом с нуля.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--verify-only',
+            action='store_true',
+            help='Только сверить таблицу, не перестраивая её.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Размер пакета bulk_create при перестроении.',
+        )
+
+    def handle(self, *args, **options):
+        if not options['verify_only']:
+            shopping_list.rebuild(batch_size=options['batch_size'])
+            self.stdout.write('Таблица списков покупок перестроена.')
+
+        mismatches = shopping_list.find_mismatches()
+        if mismatches:
+            for (user_id, ingredient_id), (stored, expected) in sorted(
+                mismatches.items()
+            ):
+                self.stderr.write(
+                    f'user={user_id} ingredient={ingredient_id}: '
+                    f'в таблице {stored}, ожидается {expected}'
+                )
+            raise CommandError(f'Расхождений: {len(mismatches)}')
+        self.stdout.write(self.style.SUCCESS('Расхождений не найдено.'))
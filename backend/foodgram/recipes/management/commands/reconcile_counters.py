@@ -0,0 +1,35 @@
+from django.core.management.base import BaseCommand
+
+from recipes import counters
+
+
+class Command(BaseCommand):
+    help = (
+        'Сверяет денормализованные счётчики рецептов и пользователей с '
+        'фактическим количеством связей и исправляет расхождения.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--dry-run',
+            action='store_true',
+            help='Только показать расхождения, не исправляя их.',
+        )
+        parser.add_argument(
+            '--batch-size',
+            type=int,
+            default=1000,
+            help='Количество строк в одном UPDATE.',
+        )
+
+    def handle(self, *args, **options):
+        fixed = counters.reconcile(
+            batch_size=options['batch_size'], dry_run=options['dry_run']
+        )
+        for (model, field), count in fixed.items():
+            self.stdout.write(f'{model}.{field}: расхождений {count}')
+        total = sum(fixed.values())
+        if options['dry_run'] or not total:
+            self.stdout.write(f'Всего расхождений: {total}')
+        else:
+            self.stdout.write(self.style.SUCCESS(f'Исправлено строк: {total}'))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from api.caching import response_cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Показывает попадания и промахи кэша ответов для анонимных.'
+
+    def handle(self, *args, **options):
+        stats = response_cache_stats()
+        total = stats['hit'] + stats['miss']
+        ratio = stats['hit'] / total if total else 0
+        self.stdout.write(
+            f'Попаданий: {stats["hit"]}, промахов: {stats["miss"]}, '
+            f'доля попаданий: {ratio:.1%}'
+        )
@@ -0,0 +1,402 @@
+import http.client
+import json
+import math
+import random
+import statistics
+import threading
+import time
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import ExitStack
+from datetime import datetime, timezone
+from urllib.parse import quote, urlsplit
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, connections
+from django.test import Client
+from rest_framework.authtoken.models import Token
+
+from api.middleware import QueryStats
+from recipes.models import Favorite, Ingredient, Recipe, ShoppingCart, Tag
+from users.models import CustomUser, Follower
+
+
+class Fixture:
+    """Пользователь, токен и идентификаторы, по которым строятся запросы."""
+
+    def __init__(self, rnd, username=None):
+        if username:
+            user = CustomUser.objects.filter(username=username).first()
+            if user is None:
+                raise CommandError(f'Пользователь {username} не найден.')
+        else:
+            follower = Follower.objects.order_by('id').first()
+            user = (
+                follower.followed_user if follower
+                else CustomUser.objects.order_by('id').first()
+            )
+        if user is None:
+            raise CommandError(
+                'Нет данных для замеров, запустите seed_benchmark_data.'
+            )
+        self.user = user
+        self.token = Token.objects.get_or_create(user=user)[0].key
+        recipe_ids = list(
+            Recipe.objects.order_by('id').values_list('id', flat=True)[:10000]
+        )
+        if not recipe_ids:
+            raise CommandError('Нет рецептов для замеров.')
+        self.recipe_ids = rnd.sample(recipe_ids, min(len(recipe_ids), 1000))
+        self.toggle_ids = self.free_recipe_ids(Favorite)
+        self.cart_ids = self.free_recipe_ids(ShoppingCart)
+        followed = set(user.following.values_list(
+            'following_user_id', flat=True
+        ))
+        self.author_ids = [
+            author_id for author_id in CustomUser.objects.exclude(
+                id=user.id
+            ).order_by('id').values_list('id', flat=True)[:1000]
+            if author_id not in followed
+        ]
+        self.tag_slugs = list(Tag.objects.values_list('slug', flat=True))
+        self.ingredient_prefixes = sorted({
+            name[:3].lower() for name in Ingredient.objects.values_list(
+                'name', flat=True
+            )[:1000]
+        })
+
+    def free_recipe_ids(self, model):
+        """Рецепты, которых ещё нет у пользователя в model."""
+        added = set(model.objects.filter(
+            user=self.user, recipe_id__in=self.recipe_ids
+        ).values_list('recipe_id', flat=True))
+        return [
+            recipe_id for recipe_id in self.recipe_ids
+            if recipe_id not in added
+        ] or self.recipe_ids
+
+
+def recipe_list(fixture, rnd):
+    return [('GET', f'/api/recipes/?page={rnd.randint(1, 20)}&limit=6')]
+
+
+def recipe_list_anonymous(fixture, rnd):
+    return [('GET', '/api/recipes/?page=1&limit=6', False)]
+
+
+def recipe_list_filtered(fixture, rnd):
+    tags = '&'.join(
+        f'tags={slug}'
+        for slug in rnd.sample(fixture.tag_slugs, min(
+            2, len(fixture.tag_slugs)
+        ))
+    )
+    return [('GET', f'/api/recipes/?{tags}&limit=6')]
+
+
+def recipe_list_favorited(fixture, rnd):
+    return [('GET', '/api/recipes/?is_favorited=1&limit=6')]
+
+
+def recipe_detail(fixture, rnd):
+    return [('GET', f'/api/recipes/{rnd.choice(fixture.recipe_ids)}/')]
+
+
+def subscriptions(fixture, rnd):
+    return [('GET', '/api/users/subscriptions/?recipes_limit=3')]
+
+
+def shopping_list(fixture, rnd):
+    return [('GET', '/api/recipes/download_shopping_cart/')]
+
+
+def ingredient_search(fixture, rnd):
+    prefix = rnd.choice(fixture.ingredient_prefixes or [''])
+    return [('GET', f'/api/ingredients/?name={quote(prefix)}')]
+
+
+def favorite_toggle(fixture, rnd):
+    path = f'/api/recipes/{rnd.choice(fixture.toggle_ids)}/favorite/'
+    return [('POST', path), ('DELETE', path)]
+
+
+def cart_toggle(fixture, rnd):
+    path = f'/api/recipes/{rnd.choice(fixture.cart_ids)}/shopping_cart/'
+    return [('POST', path), ('DELETE', path)]
+
+
+def subscribe_toggle(fixture, rnd):
+    if not fixture.author_ids:
+        raise CommandError('Нет авторов для подписки.')
+    path = f'/api/users/{rnd.choice(fixture.author_ids)}/subscribe/'
+    return [('POST', path), ('DELETE', path)]
+
+
+SCENARIOS = {
+    'recipe-list': recipe_list,
+    'recipe-list-anonymous': recipe_list_anonymous,
+    'recipe-list-filtered': recipe_list_filtered,
+    'recipe-list-favorited': recipe_list_favorited,
+    'recipe-detail': recipe_detail,
+    'subscriptions': subscriptions,
+    'shopping-list': shopping_list,
+    'ingredient-search': ingredient_search,
+    'favorite-toggle': favorite_toggle,
+    'cart-toggle': cart_toggle,
+    'subscribe-toggle': subscribe_toggle,
+}
+
+
+class InProcessClient:
+    """Запросы через django.test.Client в текущем процессе."""
+
+    def __init__(self, token):
+        host = next((
+            host.lstrip('.') for host in settings.ALLOWED_HOSTS
+            if host != '*'
+        ), 'localhost')
+        self.client = Client(HTTP_HOST=host)
+        self.authorization = f'Token {token}'
+
+    def request(self, method, path, auth=True):
+        headers = {'HTTP_AUTHORIZATION': self.authorization} if auth else {}
+        queries = QueryStats()
+        started = time.perf_counter()
+        with ExitStack() as stack:
+            for alias in connections:
+                stack.enter_context(
+                    connections[alias].execute_wrapper(queries)
+                )
+            response = self.client.generic(method, path, **headers)
+            if response.streaming:
+                b''.join(response.streaming_content)
+        return (
+            response.status_code, time.perf_counter() - started,
+            queries.count,
+        )
+
+    def query_totals(self):
+        return None
+
+
+class HttpClient:
+    """Запросы к запущенному серверу, по соединению на поток."""
+
+    def __init__(self, url, token):
+        parts = urlsplit(url)
+        self.connection_class = (
+            http.client.HTTPSConnection if parts.scheme == 'https'
+            else http.client.HTTPConnection
+        )
+        self.netloc = parts.netloc
+        self.prefix = parts.path.rstrip('/')
+        self.authorization = f'Token {token}'
+        self.local = threading.local()
+
+    def connection(self):
+        if getattr(self.local, 'connection', None) is None:
+            self.local.connection = self.connection_class(
+                self.netloc, timeout=60
+            )
+        return self.local.connection
+
+    def request(self, method, path, auth=True):
+        headers = {'Authorization': self.authorization} if auth else {}
+        started = time.perf_counter()
+        try:
+            connection = self.connection()
+            connection.request(method, self.prefix + path, headers=headers)
+            response = connection.getresponse()
+            response.read()
+        except (OSError, http.client.HTTPException):
+            self.local.connection = None
+            return None, time.perf_counter() - started, None
+        return response.status, time.perf_counter() - started, None
+
+    def query_totals(self):
+        """
+        Суммарные число SQL-запросов и число запросов из /api/metrics.
+        Без PROMETHEUS_MULTIPROC_DIR верно только для одного процесса.
+        """
+        connection = self.connection_class(self.netloc, timeout=60)
+        try:
+            connection.request('GET', self.prefix + '/api/metrics')
+            response = connection.getresponse()
+            body = response.read().decode()
+        except (OSError, http.client.HTTPException):
+            return None
+        finally:
+            connection.close()
+        if response.status != 200:
+            return None
+        totals = {'sum': 0.0, 'count': 0.0}
+        for line in body.splitlines():
+            for kind in totals:
+                if line.startswith(f'foodgram_sql_queries_per_request_{kind}'):
+                    totals[kind] += float(line.rsplit(' ', 1)[1])
+        return totals
+
+
+def percentile(values, percent):
+    """Процентиль по ближайшему рангу для отсортированного списка."""
+    return values[max(math.ceil(percent / 100 * len(values)) - 1, 0)]
+
+
+class Command(BaseCommand):
+    help = (
+        'Нагрузочный замер основных эндпоинтов: список рецептов с фильтрами, '
+        'рецепт, подписки, выгрузка списка покупок, поиск ингредиентов, '
+        'добавление и удаление из избранного, корзины и подписок. Запросы '
+        'выполняются в процессе через тестовый клиент или отправляются на '
+        '--url, например поочерёдно на gunicorn и uvicorn с --compare. '
+        'Выводит p50/p95/p99, запросы в секунду и SQL-запросы на запрос.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument(
+            '--url',
+            help='Адрес запущенного сервера, например http://127.0.0.1:9000.'
+                 ' Без него запросы выполняются в текущем процессе.',
+        )
+        parser.add_argument(
+            '--scenario', action='append', choices=SCENARIOS,
+            help='Сценарий; можно указать несколько. По умолчанию все.',
+        )
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--warmup', type=int, default=10)
+        parser.add_argument(
+            '--concurrency', type=int, default=1,
+            help='Параллельных соединений (только с --url).',
+        )
+        parser.add_argument('--user', help='Пользователь, от имени которого '
+                                           'выполняются запросы.')
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--output', help='Файл для отчёта в JSON.')
+        parser.add_argument(
+            '--compare', help='JSON-отчёт прошлого запуска для сравнения.',
+        )
+
+    def handle(self, *args, **options):
+        if options['concurrency'] > 1 and not options['url']:
+            raise CommandError('--concurrency работает только с --url.')
+        rnd = random.Random(options['seed'])
+        fixture = Fixture(rnd, options['user'])
+        client = (
+            HttpClient(options['url'], fixture.token) if options['url']
+            else InProcessClient(fixture.token)
+        )
+        results = {}
+        for name in options['scenario'] or SCENARIOS:
+            results[name] = self.run(
+                client, SCENARIOS[name], fixture, rnd, options
+            )
+            self.report(name, results[name])
+
+        report = {
+            'started_at': datetime.now(timezone.utc).isoformat(),
+            'target': options['url'] or 'in-process',
+            'database': connection.vendor,
+            'recipes': Recipe.objects.count(),
+            'users': CustomUser.objects.count(),
+            'requests': options['requests'],
+            'concurrency': options['concurrency'],
+            'seed': options['seed'],
+            'scenarios': results,
+        }
+        if options['output']:
+            with open(options['output'], 'w') as file:
+                json.dump(report, file, ensure_ascii=False, indent=2)
+            self.stdout.write(f'Отчёт записан в {options["output"]}')
+        if options['compare']:
+            self.compare(options['compare'], results)
+
+    def run(self, client, scenario, fixture, rnd, options):
+        batches = [
+            scenario(fixture, rnd)
+            for _ in range(options['warmup'] + options['requests'])
+        ]
+        for requests in batches[:options['warmup']]:
+            self.perform(client, requests)
+        batches = batches[options['warmup']:]
+
+        before = client.query_totals()
+        started = time.perf_counter()
+        with ThreadPoolExecutor(options['concurrency']) as executor:
+            measured = [
+                result
+                for results in executor.map(
+                    lambda requests: self.perform(client, requests), batches
+                )
+                for result in results
+            ]
+        elapsed = time.perf_counter() - started
+        after = client.query_totals()
+
+        statuses = Counter(status for status, _, _ in measured)
+        latencies = sorted(duration * 1000 for _, duration, _ in measured)
+        queries = [count for _, _, count in measured if count is not None]
+        if queries:
+            queries_per_request = statistics.mean(queries)
+        elif before is not None and after is not None:
+            # Сам первый запрос /api/metrics учитывается во втором.
+            count = after['count'] - before['count'] - 1
+            queries_per_request = (
+                (after['sum'] - before['sum']) / count if count > 0 else None
+            )
+        else:
+            queries_per_request = None
+        return {
+            'requests': len(measured),
+            'errors': sum(
+                count for status, count in statuses.items()
+                if status is None or status >= 400
+            ),
+            'statuses': {
+                str(status): count for status, count in statuses.items()
+            },
+            'rps': len(measured) / elapsed,
+            'mean_ms': statistics.mean(latencies),
+            'p50_ms': percentile(latencies, 50),
+            'p95_ms': percentile(latencies, 95),
+            'p99_ms': percentile(latencies, 99),
+            'max_ms': latencies[-1],
+            'queries_per_request': queries_per_request,
+        }
+
+    @staticmethod
+    def perform(client, requests):
+        return [client.request(*request) for request in requests]
+
+    def report(self, name, result):
+        queries = result['queries_per_request']
+        self.stdout.write(
+            f'{name}: p50 {result["p50_ms"]:.1f} мс, '
+            f'p95 {result["p95_ms"]:.1f} мс, '
+            f'p99 {result["p99_ms"]:.1f} мс, '
+            f'{result["rps"]:.1f} зап/с, '
+            f'SQL {"—" if queries is None else f"{queries:.1f}"}, '
+            f'ошибок {result["errors"]}'
+        )
+
+    def compare(self, path, results):
+        with open(path) as file:
+            previous = json.load(file)['scenarios']
+        self.stdout.write(f'Сравнение с {path}:')
+        for name, result in results.items():
+            if name not in previous:
+                continue
+            old = previous[name]
+            self.stdout.write(
+                f'{name}: p95 {old["p95_ms"]:.1f} -> '
+                f'{result["p95_ms"]:.1f} мс '
+                f'({self.change(old["p95_ms"], result["p95_ms"])}), '
+                f'{old["rps"]:.1f} -> {result["rps"]:.1f} зап/с '
+                f'({self.change(old["rps"], result["rps"])})'
+            )
+
+    @staticmethod
+    def change(old, new):
+        if not old:
+            return '—'
+        return f'{(new - old) / old * 100:+.1f}%'
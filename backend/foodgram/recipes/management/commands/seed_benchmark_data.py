@@ -0,0 +1,257 @@
+import random
+import time
+from collections import Counter
+
+from django.contrib.auth.hashers import make_password
+from django.core.management.base import BaseCommand, CommandError
+from django.db import transaction
+
+from api.caching import (RECIPE_LIST_VERSION, bump_version,
+                         model_version_name, response_cache)
+from recipes import shopping_list
+from recipes.models import (Favorite, Ingredient, IngredientInRecipe, Recipe,
+                            ShoppingCart, ShoppingListItem, Tag)
+from users.models import CustomUser, Follower
+
+
+class Command(BaseCommand):
+    help = (
+        'Создаёт воспроизводимый набор данных для нагрузочных замеров: '
+        'пользователей, рецепты, тэги, ингредиенты рецептов, избранное, '
+        'корзины и подписки. Связи выбираются генератором с фиксированным '
+        'seed, строки вставляются через bulk_create, счётчики и списки '
+        'покупок заполняются сразу.'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--users', type=int, default=10_000)
+        parser.add_argument(
+            '--authors', type=int, default=None,
+            help='Сколько пользователей публикуют рецепты '
+                 '(по умолчанию десятая часть).',
+        )
+        parser.add_argument('--recipes', type=int, default=100_000)
+        parser.add_argument('--tags', type=int, default=20)
+        parser.add_argument(
+            '--ingredients', type=int, default=2000,
+            help='Минимальное количество ингредиентов в справочнике; '
+                 'недостающие создаются.',
+        )
+        parser.add_argument('--tags-per-recipe', type=int, default=2)
+        parser.add_argument('--ingredients-per-recipe', type=int, default=6)
+        parser.add_argument('--favorites-per-user', type=int, default=20)
+        parser.add_argument('--carts-per-user', type=int, default=5)
+        parser.add_argument('--follows-per-user', type=int, default=10)
+        parser.add_argument('--seed', type=int, default=42)
+        parser.add_argument('--batch-size', type=int, default=5000)
+        parser.add_argument(
+            '--prefix', default='bench',
+            help='Префикс имён пользователей, тэгов и ингредиентов.',
+        )
+        parser.add_argument(
+            '--clear', action='store_true',
+            help='Удалить ранее созданные данные с этим префиксом.',
+        )
+
+    def handle(self, *args, **options):
+        prefix = options['prefix']
+        if not 0 < len(prefix) <= 8:
+            raise CommandError('Префикс должен быть от 1 до 8 символов.')
+        if options['clear']:
+            self.clear(prefix)
+        if CustomUser.objects.filter(
+            username__startswith=f'{prefix}_'
+        ).exists():
+            raise CommandError(
+                f'Данные с префиксом {prefix} уже есть, используйте --clear.'
+            )
+        options['authors'] = min(
+            options['authors'] or max(options['users'] // 10, 1),
+            options['users'],
+        )
+        if options['users'] < 1 or options['recipes'] < 1:
+            raise CommandError('Нужен хотя бы один пользователь и рецепт.')
+
+        started = time.monotonic()
+        self.rows = Counter()
+        with transaction.atomic():
+            self.seed(random.Random(options['seed']), options)
+        response_cache.clear()
+        for name in (
+            RECIPE_LIST_VERSION, model_version_name(Recipe),
+            model_version_name(CustomUser), model_version_name(Tag),
+        ):
+            bump_version(name)
+
+        for table, count in self.rows.items():
+            self.stdout.write(f'{table}: {count}')
+        self.stdout.write(self.style.SUCCESS(
+            f'Создано строк: {sum(self.rows.values())} '
+            f'за {time.monotonic() - started:.1f} с'
+        ))
+
+    def clear(self, prefix):
+        with transaction.atomic():
+            users = CustomUser.objects.filter(
+                username__startswith=f'{prefix}_'
+            )
+            Recipe.objects.filter(author__in=users).delete()
+            users.delete()
+            Tag.objects.filter(slug__startswith=f'{prefix}-').delete()
+            Ingredient.objects.filter(
+                name__startswith=f'{prefix} '
+            ).delete()
+        self.stdout.write(f'Данные с префиксом {prefix} удалены.')
+
+    def create(self, model, objects, batch_size):
+        """bulk_create пакетами; возвращает созданные объекты с id."""
+        created = []
+        for start in range(0, len(objects), batch_size):
+            created.extend(model.objects.bulk_create(
+                objects[start:start + batch_size]
+            ))
+        self.rows[model._meta.db_table] += len(objects)
+        return created
+
+    @staticmethod
+    def sample(rnd, population, count, exclude=None):
+        """count различных элементов range(population) кроме exclude."""
+        extra = exclude is not None
+        count = min(count, population - extra)
+        if count <= 0:
+            return []
+        picked = rnd.sample(range(population), count + extra)
+        if exclude in picked:
+            picked.remove(exclude)
+        return picked[:count]
+
+    def seed(self, rnd, options):
+        prefix = options['prefix']
+        batch_size = options['batch_size']
+        user_count = options['users']
+        recipe_count = options['recipes']
+
+        # Связи выбираются заранее, чтобы строки со счётчиками сразу
+        # создавались с правильными значениями.
+        recipe_authors = [
+            rnd.randrange(options['authors']) for _ in range(recipe_count)
+        ]
+        follows = [
+            self.sample(rnd, options['authors'],
+                        options['follows_per_user'], exclude=user)
+            for user in range(user_count)
+        ]
+        favorites = [
+            self.sample(rnd, recipe_count, options['favorites_per_user'])
+            for _ in range(user_count)
+        ]
+        carts = [
+            self.sample(rnd, recipe_count, options['carts_per_user'])
+            for _ in range(user_count)
+        ]
+        recipes_count = Counter(recipe_authors)
+        followers_count = Counter(
+            author for authors in follows for author in authors
+        )
+        favorites_count = Counter(
+            recipe for recipes in favorites for recipe in recipes
+        )
+        carts_count = Counter(
+            recipe for recipes in carts for recipe in recipes
+        )
+
+        password = make_password(None)
+        users = self.create(CustomUser, [
+            CustomUser(
+                username=f'{prefix}_{user:07}',
+                email=f'{prefix}_{user:07}@example.com',
+                first_name='Benchmark', last_name=f'User {user}',
+                password=password,
+                recipes_count=recipes_count[user],
+                followers_count=followers_count[user],
+            )
+            for user in range(user_count)
+        ], batch_size)
+        user_ids = [user.id for user in users]
+
+        tags = self.create(Tag, [
+            Tag(
+                name=f'{prefix} тэг {tag}', slug=f'{prefix}-{tag}',
+                color=f'#{rnd.randrange(0x1000000):06X}',
+            )
+            for tag in range(options['tags'])
+        ], batch_size)
+        tag_ids = [tag.id for tag in tags]
+
+        ingredient_ids = list(Ingredient.objects.values_list('id', flat=True))
+        missing = options['ingredients'] - len(ingredient_ids)
+        if missing > 0:
+            ingredient_ids.extend(ingredient.id for ingredient in self.create(
+                Ingredient, [
+                    Ingredient(
+                        name=f'{prefix} ингредиент {ingredient}',
+                        measurement_unit=rnd.choice(('г', 'мл', 'шт.')),
+                    )
+                    for ingredient in range(missing)
+                ], batch_size
+            ))
+
+        recipe_ids = []
+        Through = Recipe.tags.through
+        for start in range(0, recipe_count, batch_size):
+            recipes = self.create(Recipe, [
+                Recipe(
+                    author_id=user_ids[recipe_authors[recipe]],
+                    name=f'{prefix} рецепт {recipe}',
+                    text=f'Описание рецепта {recipe} для замеров.',
+                    cooking_time=rnd.randint(1, 240),
+                    image=f'{prefix}.png',
+                    favorites_count=favorites_count[recipe],
+                    shopping_carts_count=carts_count[recipe],
+                )
+                for recipe in range(
+                    start, min(start + batch_size, recipe_count)
+                )
+            ], batch_size)
+            recipe_ids.extend(recipe.id for recipe in recipes)
+            self.create(Through, [
+                Through(recipe_id=recipe.id, tag_id=tag_id)
+                for recipe in recipes
+                for tag_id in rnd.sample(tag_ids, min(
+                    options['tags_per_recipe'], len(tag_ids)
+                ))
+            ], batch_size)
+            self.create(IngredientInRecipe, [
+                IngredientInRecipe(
+                    recipe_id=recipe.id, ingredient_id=ingredient_id,
+                    amount=rnd.randint(1, 500),
+                )
+                for recipe in recipes
+                for ingredient_id in rnd.sample(ingredient_ids, min(
+                    options['ingredients_per_recipe'], len(ingredient_ids)
+                ))
+            ], batch_size)
+
+        self.create(Follower, [
+            Follower(
+                followed_user_id=user_ids[user],
+                following_user_id=user_ids[author],
+            )
+            for user, authors in enumerate(follows)
+            for author in authors
+        ], batch_size)
+        for model, relations in ((Favorite, favorites),
+                                 (ShoppingCart, carts)):
+            self.create(model, [
+                model(user_id=user_ids[user], recipe_id=recipe_ids[recipe])
+                for user, recipes in enumerate(relations)
+                for recipe in recipes
+            ], batch_size)
+
+        for start in range(0, user_count, batch_size):
+            shopping_list.refresh(user_ids[start:start + batch_size])
+        self.rows[ShoppingListItem._meta.db_table] = (
+            ShoppingListItem.objects.filter(
+                user__username__startswith=f'{prefix}_'
+            ).count()
+        )
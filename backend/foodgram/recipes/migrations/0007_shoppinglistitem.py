@@ -0,0 +1,52 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:37
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+from django.db.models import Sum
+
+
+def fill_shopping_list(apps, schema_editor):
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    totals = ShoppingCart.objects.filter(
+        recipe__ingredient_amount__isnull=False
+    ).values_list(
+        'user_id', 'recipe__ingredient_amount__ingredient_id'
+    ).annotate(
+        total_amount=Sum('recipe__ingredient_amount__amount')
+    ).order_by()
+    ShoppingListItem.objects.bulk_create(
+        ShoppingListItem(
+            user_id=user_id,
+            ingredient_id=ingredient_id,
+            total_amount=total_amount,
+        )
+        for user_id, ingredient_id, total_amount in totals
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0006_alter_favorite_options_alter_ingredient_options_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ShoppingListItem',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('total_amount', models.PositiveIntegerField(verbose_name='Количество')),
+                ('ingredient', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to='recipes.ingredient', verbose_name='Ингредиент')),
+                ('user', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='shopping_list_items', to=settings.AUTH_USER_MODEL, verbose_name='Пользователь')),
+            ],
+            options={
+                'verbose_name': 'Позиция списка покупок',
+                'verbose_name_plural': 'Список покупок',
+                'unique_together': {('user', 'ingredient')},
+            },
+        ),
+        migrations.RunPython(fill_shopping_list, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,78 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:40
+
+from django.db import migrations
+from django.db.models import Count, Min
+
+
+def merge_duplicate_ingredients(apps, schema_editor):
+    """
+    Объединяет ингредиенты с одинаковыми названием и единицей, которые
+    мог оставить прежний загрузчик: рецепты и списки покупок переводятся
+    на ингредиент с наименьшим id, количества складываются.
+    """
+    Ingredient = apps.get_model('recipes', 'Ingredient')
+    IngredientInRecipe = apps.get_model('recipes', 'IngredientInRecipe')
+    ShoppingListItem = apps.get_model('recipes', 'ShoppingListItem')
+    groups = Ingredient.objects.values('name', 'measurement_unit').annotate(
+        keep_id=Min('id'), count=Count('id')
+    ).filter(count__gt=1).order_by()
+    for group in groups:
+        keep_id = group['keep_id']
+        duplicate_ids = list(Ingredient.objects.filter(
+            name=group['name'], measurement_unit=group['measurement_unit']
+        ).exclude(id=keep_id).values_list('id', flat=True))
+
+        IngredientInRecipe.objects.filter(
+            ingredient_id__in=duplicate_ids
+        ).update(ingredient_id=keep_id)
+        recipe_ids = IngredientInRecipe.objects.filter(
+            ingredient_id=keep_id
+        ).values('recipe_id').annotate(count=Count('id')).filter(
+            count__gt=1
+        ).values_list('recipe_id', flat=True)
+        for recipe_id in list(recipe_ids):
+            first, *rest = IngredientInRecipe.objects.filter(
+                recipe_id=recipe_id, ingredient_id=keep_id
+            ).order_by('id')
+            first.amount += sum(row.amount for row in rest)
+            first.save(update_fields=['amount'])
+            IngredientInRecipe.objects.filter(
+                id__in=[row.id for row in rest]
+            ).delete()
+
+        for item in ShoppingListItem.objects.filter(
+            ingredient_id__in=duplicate_ids
+        ):
+            kept = ShoppingListItem.objects.filter(
+                user_id=item.user_id, ingredient_id=keep_id
+            ).first()
+            if kept is None:
+                item.ingredient_id = keep_id
+                item.save(update_fields=['ingredient'])
+            else:
+                kept.total_amount += item.total_amount
+                kept.save(update_fields=['total_amount'])
+                item.delete()
+
+        Ingredient.objects.filter(id__in=duplicate_ids).delete()
+
+
+class Migration(migrations.Migration):
+    # Данные объединяются в отдельной транзакции: PostgreSQL не даёт
+    # изменять таблицу с отложенными проверками внешних ключей.
+    atomic = False
+
+    dependencies = [
+        ('recipes', '0007_shoppinglistitem'),
+    ]
+
+    operations = [
+        migrations.RunPython(
+            merge_duplicate_ingredients, migrations.RunPython.noop,
+            atomic=True,
+        ),
+        migrations.AlterUniqueTogether(
+            name='ingredient',
+            unique_together={('name', 'measurement_unit')},
+        ),
+    ]
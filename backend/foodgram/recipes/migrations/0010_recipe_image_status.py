@@ -0,0 +1,18 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:43
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0009_recipe_image_variants'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='image_status',
+            field=models.CharField(choices=[('processing', 'Обрабатывается'), ('ready', 'Готова'), ('failed', 'Ошибка обработки')], default='ready', max_length=16, verbose_name='Статус обработки картинки'),
+        ),
+    ]
@@ -0,0 +1,50 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:45
+
+from django.conf import settings
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+        ('recipes', '0010_recipe_image_status'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='favorite',
+            options={'verbose_name': 'Избранное', 'verbose_name_plural': 'Избранное'},
+        ),
+        migrations.AlterModelOptions(
+            name='ingredientinrecipe',
+            options={'verbose_name': 'Ингридиенты в рецепте', 'verbose_name_plural': 'Ингридиенты в рецепте'},
+        ),
+        migrations.AlterModelOptions(
+            name='shoppingcart',
+            options={'verbose_name': 'Корзина', 'verbose_name_plural': 'Корзина'},
+        ),
+        migrations.AddIndex(
+            model_name='ingredientinrecipe',
+            index=models.Index(fields=['recipe', 'ingredient'], name='ingredientinrecipe_recipe_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['name'], name='recipe_name_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='recipe',
+            index=models.Index(fields=['author', 'name'], name='recipe_author_name_idx'),
+        ),
+        migrations.AlterField(
+            model_name='ingredientinrecipe',
+            name='recipe',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='ingredient_amount', to='recipes.recipe', verbose_name='Рецепт'),
+        ),
+        migrations.AlterField(
+            model_name='recipe',
+            name='author',
+            field=models.ForeignKey(db_index=False, on_delete=django.db.models.deletion.CASCADE, related_name='user_recipes', to=settings.AUTH_USER_MODEL, verbose_name='Автор'),
+        ),
+    ]
@@ -0,0 +1,53 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:50
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+
+
+def related_count(model, field):
+    return Coalesce(
+        Subquery(
+            model.objects.filter(**{field: OuterRef('pk')}).order_by()
+            .values(field).annotate(total=Count('pk')).values('total')
+        ),
+        0,
+    )
+
+
+def fill_counters(apps, schema_editor):
+    Recipe = apps.get_model('recipes', 'Recipe')
+    Favorite = apps.get_model('recipes', 'Favorite')
+    ShoppingCart = apps.get_model('recipes', 'ShoppingCart')
+    CustomUser = apps.get_model('users', 'CustomUser')
+    Follower = apps.get_model('users', 'Follower')
+    Recipe.objects.update(
+        favorites_count=related_count(Favorite, 'recipe'),
+        shopping_carts_count=related_count(ShoppingCart, 'recipe'),
+    )
+    CustomUser.objects.update(
+        recipes_count=related_count(Recipe, 'author'),
+        followers_count=related_count(Follower, 'following_user'),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0011_indexes_and_orderings'),
+        ('users', '0005_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='recipe',
+            name='favorites_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество добавлений в избранное'),
+        ),
+        migrations.AddField(
+            model_name='recipe',
+            name='shopping_carts_count',
+            field=models.PositiveIntegerField(default=0, verbose_name='Количество добавлений в корзину'),
+        ),
+        migrations.RunPython(fill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,109 @@
+from django.db import migrations
+
+SEARCH_CONFIG = 'russian'
+
+POSTGRESQL_FORWARD = [
+    'ALTER TABLE recipes_recipe ADD COLUMN search_vector tsvector',
+    f"""
+    CREATE FUNCTION recipes_recipe_search_vector_update() RETURNS trigger AS $$
+    BEGIN
+        NEW.search_vector :=
+            setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.name, '')), 'A')
+            || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(NEW.text, '')), 'B');
+        RETURN NEW;
+    END
+    $$ LANGUAGE plpgsql
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_search_vector_trigger
+    BEFORE INSERT OR UPDATE OF name, text ON recipes_recipe
+    FOR EACH ROW EXECUTE PROCEDURE recipes_recipe_search_vector_update()
+    """,
+    f"""
+    UPDATE recipes_recipe SET search_vector =
+        setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(name, '')), 'A')
+        || setweight(to_tsvector('{SEARCH_CONFIG}', coalesce(text, '')), 'B')
+    """,
+    'CREATE INDEX recipe_search_vector_idx ON recipes_recipe '
+    'USING GIN (search_vector)',
+]
+
+POSTGRESQL_BACKWARD = [
+    'DROP TRIGGER IF EXISTS recipes_recipe_search_vector_trigger '
+    'ON recipes_recipe',
+    'DROP FUNCTION IF EXISTS recipes_recipe_search_vector_update()',
+    'ALTER TABLE recipes_recipe DROP COLUMN IF EXISTS search_vector',
+]
+
+SQLITE_FORWARD = [
+    """
+    CREATE VIRTUAL TABLE recipes_recipe_fts USING fts5(
+        name, text, content='recipes_recipe', content_rowid='id',
+        tokenize='unicode61'
+    )
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_fts_insert AFTER INSERT ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_fts_delete AFTER DELETE ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER recipes_recipe_fts_update
+    AFTER UPDATE OF name, text ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    "INSERT INTO recipes_recipe_fts (recipes_recipe_fts) VALUES ('rebuild')",
+]
+
+SQLITE_BACKWARD = [
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_insert',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_delete',
+    'DROP TRIGGER IF EXISTS recipes_recipe_fts_update',
+    'DROP TABLE IF EXISTS recipes_recipe_fts',
+]
+
+STATEMENTS = {
+    'postgresql': (POSTGRESQL_FORWARD, POSTGRESQL_BACKWARD),
+    'sqlite': (SQLITE_FORWARD, SQLITE_BACKWARD),
+}
+
+
+def run(schema_editor, forward):
+    statements = STATEMENTS.get(schema_editor.connection.vendor)
+    if statements is None:
+        return
+    for sql in statements[0 if forward else 1]:
+        schema_editor.execute(sql)
+
+
+def create_search_index(apps, schema_editor):
+    run(schema_editor, forward=True)
+
+
+def drop_search_index(apps, schema_editor):
+    run(schema_editor, forward=False)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('recipes', '0012_denormalized_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
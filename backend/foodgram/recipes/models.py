@@ -17,6 +17,7 @@ class Ingredient(models.Model):
 
     class Meta:
         ordering = ('name',)
+        unique_together = ['name', 'measurement_unit']
         verbose_name = "Ингредиент"
         verbose_name_plural = "Ингредиенты"
 
@@ -50,6 +51,11 @@ class Tag(models.Model):
 
 
 class Recipe(models.Model):
+    class ImageStatus(models.TextChoices):
+        PROCESSING = 'processing', 'Обрабатывается'
+        READY = 'ready', 'Готова'
+        FAILED = 'failed', 'Ошибка обработки'
+
     ingredients = models.ManyToManyField(
         verbose_name='Ингредиенты',
         to=Ingredient,
@@ -64,12 +70,24 @@ class Recipe(models.Model):
         verbose_name='Автор',
         to=CustomUser,
         related_name='user_recipes',
-        on_delete=models.CASCADE
+        on_delete=models.CASCADE,
+        db_index=False
     )
     image = models.ImageField(
         verbose_name='Картинка',
         upload_to='ingredients/images/'
     )
+    image_variants = models.JSONField(
+        verbose_name='Уменьшенные копии картинки',
+        default=dict,
+        blank=True
+    )
+    image_status = models.CharField(
+        verbose_name='Статус обработки картинки',
+        max_length=16,
+        choices=ImageStatus.choices,
+        default=ImageStatus.READY
+    )
     name = models.CharField(
         verbose_name='Название',
         max_length=200
@@ -84,9 +102,23 @@ class Recipe(models.Model):
             MaxValueValidator(settings.INT_MAX_VALUE)
         ]
     )
+    favorites_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в избранное',
+        default=0
+    )
+    shopping_carts_count = models.PositiveIntegerField(
+        verbose_name='Количество добавлений в корзину',
+        default=0
+    )
 
     class Meta:
         ordering = ('name',)
+        indexes = [
+            models.Index(fields=['name'], name='recipe_name_idx'),
+            models.Index(
+                fields=['author', 'name'], name='recipe_author_name_idx'
+            ),
+        ]
         verbose_name = "Рецепт"
         verbose_name_plural = "Рецепты"
 
@@ -109,7 +141,6 @@ class Favorite(models.Model):
     )
 
     class Meta:
-        ordering = ('-user',)
         unique_together = ['user', 'recipe']
         verbose_name = 'Избранное'
         verbose_name_plural = 'Избранное'
@@ -136,7 +167,6 @@ class ShoppingCart(models.Model):
     )
 
     class Meta:
-        ordering = ('-user',)
         unique_together = ['user', 'recipe']
         verbose_name = 'Корзина'
         verbose_name_plural = 'Корзина'
@@ -154,6 +184,7 @@ class IngredientInRecipe(models.Model):
         to=Recipe,
         related_name='ingredient_amount',
         on_delete=models.CASCADE,
+        db_index=False,
     )
     ingredient = models.ForeignKey(
         verbose_name='Ингредиент',
@@ -170,7 +201,12 @@ class IngredientInRecipe(models.Model):
     )
 
     class Meta:
-        ordering = ('-recipe',)
+        indexes = [
+            models.Index(
+                fields=['recipe', 'ingredient'],
+                name='ingredientinrecipe_recipe_idx'
+            ),
+        ]
         verbose_name = 'Ингридиенты в рецепте'
         verbose_name_plural = 'Ингридиенты в рецепте'
 
@@ -180,3 +216,32 @@ class IngredientInRecipe(models.Model):
             f'{self.ingredient.measurement_unit}. Рецепт: '
             f'{self.recipe.name}'
         )
+
+
+class ShoppingListItem(models.Model):
+    user = models.ForeignKey(
+        verbose_name='Пользователь',
+        to=CustomUser,
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE
+    )
+    ingredient = models.ForeignKey(
+        verbose_name='Ингредиент',
+        to=Ingredient,
+        related_name='shopping_list_items',
+        on_delete=models.CASCADE
+    )
+    total_amount = models.PositiveIntegerField(
+        verbose_name='Количество'
+    )
+
+    class Meta:
+        unique_together = ['user', 'ingredient']
+        verbose_name = 'Позиция списка покупок'
+        verbose_name_plural = 'Список покупок'
+
+    def __str__(self):
+        return (
+            f'{self.user.username}: {self.ingredient.name}, '
+            f'{self.total_amount} {self.ingredient.measurement_unit}'
+        )
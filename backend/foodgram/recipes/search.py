@@ -0,0 +1,118 @@
+import re
+
+from django.db import connections
+from django.db.models import BooleanField, FloatField, Q, Value
+from django.db.models.expressions import RawSQL
+
+# Должна совпадать с конфигурацией в миграции 0013_recipe_search.
+SEARCH_CONFIG = 'russian'
+FTS_TABLE = 'recipes_recipe_fts'
+
+# Триггеры FTS5 для SQLite. SQLite пересоздаёт таблицу при изменении
+# колонок в миграциях, и триггеры пропадают вместе со старой таблицей,
+# поэтому они восстанавливаются после каждого migrate.
+SQLITE_TRIGGERS = (
+    """
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_insert
+    AFTER INSERT ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_delete
+    AFTER DELETE ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+    END
+    """,
+    """
+    CREATE TRIGGER IF NOT EXISTS recipes_recipe_fts_update
+    AFTER UPDATE OF name, text ON recipes_recipe
+    BEGIN
+        INSERT INTO recipes_recipe_fts (recipes_recipe_fts, rowid, name, text)
+        VALUES ('delete', old.id, old.name, old.text);
+        INSERT INTO recipes_recipe_fts (rowid, name, text)
+        VALUES (new.id, new.name, new.text);
+    END
+    """,
+)
+
+WORD_RE = re.compile(r'\w+')
+
+
+def fts5_query(query):
+    """
+    Запрос FTS5 из пользовательского ввода: каждое слово в кавычках как
+    префикс, слова объединяются через AND. Операторы FTS5 из ввода не
+    интерпретируются.
+    """
+    return ' '.join(f'"{word}"*' for word in WORD_RE.findall(query))
+
+
+def search_recipes(queryset, query):
+    """
+    Рецепты, в названии или описании которых встречается запрос, по
+    убыванию релевантности search_rank. На PostgreSQL используется
+    колонка search_vector с GIN-индексом, на SQLite — таблица FTS5,
+    на остальных СУБД — icontains без ранжирования.
+    """
+    query = query.strip()
+    if not query:
+        return queryset
+    vendor = connections[queryset.db].vendor
+
+    if vendor == 'postgresql':
+        tsquery = f"websearch_to_tsquery('{SEARCH_CONFIG}', %s)"
+        queryset = queryset.annotate(search_rank=RawSQL(
+            f'ts_rank(recipes_recipe.search_vector, {tsquery})',
+            (query,), output_field=FloatField(),
+        )).filter(RawSQL(
+            f'recipes_recipe.search_vector @@ {tsquery}',
+            (query,), output_field=BooleanField(),
+        ))
+    elif vendor == 'sqlite':
+        match = fts5_query(query)
+        if not match:
+            return queryset.none()
+        # bm25 тем меньше, чем лучше совпадение; название весит больше.
+        queryset = queryset.annotate(search_rank=RawSQL(
+            f'SELECT -bm25({FTS_TABLE}, 10.0, 1.0) FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s '
+            f'AND {FTS_TABLE}.rowid = recipes_recipe.id',
+            (match,), output_field=FloatField(),
+        )).filter(RawSQL(
+            f'recipes_recipe.id IN (SELECT rowid FROM {FTS_TABLE} '
+            f'WHERE {FTS_TABLE} MATCH %s)',
+            (match,), output_field=BooleanField(),
+        ))
+    else:
+        queryset = queryset.annotate(
+            search_rank=Value(0.0, output_field=FloatField())
+        ).filter(Q(name__icontains=query) | Q(text__icontains=query))
+    return queryset.order_by('-search_rank', 'pk')
+
+
+def install_sqlite_triggers(connection):
+    """Восстанавливает триггеры FTS5, если таблица поиска уже создана."""
+    if connection.vendor != 'sqlite':
+        return
+    if FTS_TABLE not in connection.introspection.table_names():
+        return
+    with connection.cursor() as cursor:
+        for sql in SQLITE_TRIGGERS:
+            cursor.execute(sql)
+
+
+def rebuild(connection):
+    """Полностью перестраивает поисковый индекс по таблице рецептов."""
+    with connection.cursor() as cursor:
+        if connection.vendor == 'postgresql':
+            cursor.execute('UPDATE recipes_recipe SET name = name')
+        elif connection.vendor == 'sqlite':
+            install_sqlite_triggers(connection)
+            cursor.execute(
+                f"INSERT INTO {FTS_TABLE} ({FTS_TABLE}) VALUES ('rebuild')"
+            )
@@ -0,0 +1,136 @@
+from django.db import transaction
+from django.db.models import Sum
+
+from users.models import CustomUser
+
+from .models import ShoppingCart, ShoppingListItem
+
+# Сколько пользователей пересчитывается в одной транзакции при изменении
+# рецепта.
+REFRESH_BATCH_SIZE = 200
+
+
+def compute_totals(user_ids=None, ingredient_ids=None):
+    """
+    Считает списки покупок с нуля по корзинам: кортежи
+    (id пользователя, id ингредиента, количество).
+    """
+    lookups = {'recipe__ingredient_amount__isnull': False}
+    if user_ids is not None:
+        lookups['user_id__in'] = user_ids
+    if ingredient_ids is not None:
+        lookups['recipe__ingredient_amount__ingredient_id__in'] = (
+            ingredient_ids
+        )
+    queryset = ShoppingCart.objects.filter(**lookups)
+    return queryset.values_list(
+        'user_id', 'recipe__ingredient_amount__ingredient_id'
+    ).annotate(
+        total_amount=Sum('recipe__ingredient_amount__amount')
+    ).order_by()
+
+
+def refresh(user_ids, ingredient_ids=None):
+    """
+    Пересчитывает позиции списков покупок для указанных пользователей.
+    Если переданы ingredient_ids, затрагиваются только эти ингредиенты.
+    """
+    user_ids = sorted(set(user_ids))
+    if not user_ids:
+        return
+    items = ShoppingListItem.objects.filter(user_id__in=user_ids)
+    if ingredient_ids is not None:
+        ingredient_ids = set(ingredient_ids)
+        items = items.filter(ingredient_id__in=ingredient_ids)
+
+    with transaction.atomic():
+        list(CustomUser.objects.select_for_update().filter(
+            id__in=user_ids
+        ).order_by('id').values_list('id', flat=True))
+        items.delete()
+        ShoppingListItem.objects.bulk_create(
+            ShoppingListItem(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total_amount,
+            )
+            for user_id, ingredient_id, total_amount in compute_totals(
+                user_ids, ingredient_ids
+            )
+        )
+
+
+def refresh_in_batches(user_ids, ingredient_ids=None, batch_size=None):
+    """
+    refresh по частям по REFRESH_BATCH_SIZE пользователей: каждая часть
+    пересчитывается в своей транзакции и блокирует только своих
+    пользователей.
+    """
+    batch_size = batch_size or REFRESH_BATCH_SIZE
+    user_ids = sorted(set(user_ids))
+    for start in range(0, len(user_ids), batch_size):
+        refresh(user_ids[start:start + batch_size], ingredient_ids)
+
+
+def refresh_for_recipe(recipe, user_ids=None, ingredient_ids=None):
+    """
+    Обновляет списки покупок всех пользователей, у которых рецепт лежит
+    в корзине, после изменения его ингредиентов. Пересчёт выполняется
+    после фиксации транзакции и частями, поэтому правка популярного
+    рецепта не держит блокировки всех его покупателей.
+    """
+    recipe_id = recipe.pk
+
+    def run():
+        refresh_in_batches(
+            ShoppingCart.objects.filter(
+                recipe_id=recipe_id
+            ).values_list('user_id', flat=True)
+            if user_ids is None else user_ids,
+            ingredient_ids,
+        )
+
+    transaction.on_commit(run)
+
+
+def rebuild(batch_size=1000):
+    """Полностью перестраивает таблицу списков покупок."""
+    with transaction.atomic():
+        ShoppingListItem.objects.all().delete()
+        batch = []
+        for user_id, ingredient_id, total_amount in (
+            compute_totals().iterator(chunk_size=batch_size)
+        ):
+            batch.append(ShoppingListItem(
+                user_id=user_id,
+                ingredient_id=ingredient_id,
+                total_amount=total_amount,
+            ))
+            if len(batch) >= batch_size:
+                ShoppingListItem.objects.bulk_create(batch)
+                batch = []
+        ShoppingListItem.objects.bulk_create(batch)
+
+
+def find_mismatches():
+    """
+    Сравнивает таблицу с расчётом с нуля. Возвращает словарь
+    {(id пользователя, id ингредиента): (в таблице, ожидается)}.
+    """
+    expected = {
+        (user_id, ingredient_id): total_amount
+        for user_id, ingredient_id, total_amount in compute_totals()
+    }
+    stored = {
+        (user_id, ingredient_id): total_amount
+        for user_id, ingredient_id, total_amount in (
+            ShoppingListItem.objects.values_list(
+                'user_id', 'ingredient_id', 'total_amount'
+            )
+        )
+    }
+    return {
+        key: (stored.get(key), expected.get(key))
+        for key in expected.keys() | stored.keys()
+        if stored.get(key) != expected.get(key)
+    }
@@ -0,0 +1,48 @@
+from django.db import connections
+from django.db.models.signals import (post_delete, post_migrate, post_save,
+                                      pre_delete)
+from django.dispatch import receiver
+
+from users.models import CustomUser
+
+from . import counters, search, shopping_list
+from .models import Recipe, ShoppingCart
+
+
+@receiver(post_save, sender=Recipe)
+def increment_recipes_count(sender, instance, created, **kwargs):
+    if created:
+        counters.change(CustomUser, instance.author_id, 'recipes_count', 1)
+
+
+@receiver(post_delete, sender=Recipe)
+def decrement_recipes_count(sender, instance, **kwargs):
+    counters.change(CustomUser, instance.author_id, 'recipes_count', -1)
+
+
+@receiver(pre_delete, sender=Recipe)
+def remember_shopping_list_users(sender, instance, **kwargs):
+    instance._shopping_list_users = list(
+        ShoppingCart.objects.filter(
+            recipe=instance
+        ).values_list('user_id', flat=True)
+    )
+    if instance._shopping_list_users:
+        instance._shopping_list_ingredients = list(
+            instance.ingredient_amount.values_list('ingredient_id', flat=True)
+        )
+
+
+@receiver(post_delete, sender=Recipe)
+def refresh_shopping_lists(sender, instance, **kwargs):
+    user_ids = getattr(instance, '_shopping_list_users', None)
+    if user_ids:
+        shopping_list.refresh_for_recipe(
+            instance, user_ids, instance._shopping_list_ingredients
+        )
+
+
+@receiver(post_migrate)
+def restore_search_triggers(sender, using, **kwargs):
+    if sender.name == 'recipes':
+        search.install_sqlite_triggers(connections[using])
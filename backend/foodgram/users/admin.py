@@ -6,6 +6,7 @@ from .models import CustomUser, Follower
 
 @admin.register(CustomUser)
 class UserAdmin(admin.ModelAdmin):
+    list_display = ('username', 'email', 'recipes_count', 'followers_count')
     list_filter = ('email', 'username',)
     search_fields = ('email__startswith', 'username__startswith')
 
@@ -0,0 +1,17 @@
+# Generated by Django 4.2.6 on 2026-10-18 19:45
+
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('users', '0003_alter_customuser_options_alter_follower_options'),
+    ]
+
+    operations = [
+        migrations.AlterModelOptions(
+            name='follower',
+            options={'verbose_name': 'Подписка', 'verbose_name_plural': 'Подписки'},
+        ),
+    ]
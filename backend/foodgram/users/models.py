@@ -23,6 +23,14 @@ class CustomUser(AbstractUser):
         verbose_name='Фамилия',
         max_length=150
     )
+    recipes_count = models.PositiveIntegerField(
+        verbose_name='Количество рецептов',
+        default=0
+    )
+    followers_count = models.PositiveIntegerField(
+        verbose_name='Количество подписчиков',
+        default=0
+    )
 
     class Meta:
         ordering = ('username',)
@@ -46,7 +54,6 @@ class Follower(models.Model):
     )
 
     class Meta:
-        ordering = ('-followed_user',)
         unique_together = [['followed_user', 'following_user']]
         verbose_name = "Подписка"
         verbose_name_plural = "Подписки"